@@ -0,0 +1,179 @@
+"""Benchmark harness: fold a dataset with RAFFT and/or the ViennaRNA MFE.
+
+Sequences are folded in-process by a pool of workers. Each result is appended to
+the output file (one JSON record per line) as soon as it is available, so an
+interrupted run is resumed by running the same command again: the (method,
+name) pairs already in the file are skipped. Every record holds the predictions,
+the wall time, the peak memory, the number of energy evaluations and the
+accuracy against the reference structure (see scoring.py). Each record is
+folded by a fresh worker so its peak memory is its own (on top of the forked
+interpreter), and the energy evaluations are counted by a second, untimed,
+profiled fold.
+
+Usage:
+python bench_harness.py benchmark_cleaned_all_length.csv rafft_100n_50ms.jsonl -np 4 -n 100 -ms 50
+python bench_harness.py benchmark_cleaned_all_length.csv mfe.jsonl -np 4 --method mfe
+python bench_harness.py benchmark_cleaned_all_length.csv rafft_100n_50ms.jsonl --summary
+python bench_harness.py benchmark_cleaned_all_length.csv mfe.jsonl --summary --export mfe.csv
+"""
+
+import argparse
+import json
+import sys
+from multiprocessing import Pool
+from os import environ
+from os.path import exists
+from resource import getrusage, RUSAGE_SELF
+from time import perf_counter
+from RNA import fold as mfe_fold
+from rafft import fold
+from rafft.profiling import Profiler
+from scoring import score_structures
+
+LEN_BINS = [0, 100, 200, 400, 800, 1600]
+
+
+def method_label(args):
+    if args.method == "mfe":
+        return "mfe"
+    return f"rafft_{args.n_mode}n_{args.max_stack}ms"
+
+
+def peak_memory():
+    "high-water mark of the worker in MB (ru_maxrss is in kB on Linux)"
+    return getrusage(RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def init_worker(method, fold_args):
+    global METHOD, FOLD_ARGS
+    METHOD, FOLD_ARGS = method, fold_args
+    # the timings must not come from the result cache
+    environ.pop("RAFFT_CACHE", None)
+
+
+def run_record(record):
+    "fold one (sequence, structure, name) record"
+    seq, ref, name = record
+    start = perf_counter()
+    if METHOD == "mfe":
+        struct, nrj = mfe_fold(seq)
+        structures = [(struct, nrj)]
+    else:
+        results = fold(seq, *FOLD_ARGS)
+        structures = [(st.str_struct, st.energy) for st in results]
+    wall_time = perf_counter() - start
+    peak_mb = peak_memory()
+    nb_eval = 0
+    if METHOD != "mfe":
+        # the profiler slows the fold down, it is not timed
+        prof = Profiler()
+        fold(seq, *FOLD_ARGS, profile=prof)
+        nb_eval = prof.calls.get("vienna_eval", 0)
+    pvv, sens = score_structures([struct for struct, _ in structures], ref)
+    best = int(pvv.argmax())
+    return {"name": name, "method": METHOD, "seq": seq, "len_seq": len(seq),
+            "structs": [struct for struct, _ in structures],
+            "nrjs": [nrj for _, nrj in structures],
+            # first (best energy) structure and the best scored one
+            "pvv": float(pvv[0]), "sens": float(sens[0]),
+            "best_pvv": float(pvv[best]), "best_sens": float(sens[best]),
+            "time": wall_time, "peak_mb": peak_mb, "nb_eval": nb_eval}
+
+
+def read_records(in_file):
+    records = []
+    if exists(in_file):
+        for l in open(in_file):
+            # the last line of an interrupted run may be truncated
+            try:
+                records += [json.loads(l)]
+            except json.JSONDecodeError:
+                pass
+    return records
+
+
+def run(dataset, out_file, label, method, fold_args, nb_proc):
+    done = set(rec["name"] for rec in read_records(out_file) if rec["label"] == label)
+    todo = [rec for rec in dataset if rec[2] not in done]
+    # longest first for a better load balance
+    todo.sort(key=lambda el: -len(el[0]))
+    print(f"{label}: {len(done)} done, {len(todo)} to fold", file=sys.stderr)
+
+    # one worker per record: ru_maxrss is the peak of the whole life of a process
+    with open(out_file, "a") as out, \
+         Pool(nb_proc, initializer=init_worker, initargs=(method, fold_args),
+              maxtasksperchild=1) as pool:
+        for ri, res in enumerate(pool.imap_unordered(run_record, todo)):
+            res["label"] = label
+            out.write(json.dumps(res) + "\n")
+            out.flush()
+            if (ri + 1) % 100 == 0:
+                print(f"{ri+1}/{len(todo)}", file=sys.stderr)
+
+
+def summary(records):
+    "throughput and accuracy per method and length bin"
+    lines = [f"{'label':22s} {'length':>11s} {'nb':>5s} {'time(s)':>9s} {'nt/s':>9s} "
+             f"{'nb_eval':>9s} {'mem(MB)':>8s} {'pvv':>6s} {'sens':>6s} {'best_pvv':>8s} {'best_sens':>9s}"]
+    bins = LEN_BINS + [float("inf")]
+    for label in sorted(set(rec["label"] for rec in records)):
+        for low, high in zip(bins[:-1], bins[1:]):
+            recs = [rec for rec in records if rec["label"] == label and low <= rec["len_seq"] < high]
+            if not recs:
+                continue
+            nb = len(recs)
+            tot_time = sum(rec["time"] for rec in recs)
+            mean = lambda key: sum(rec[key] for rec in recs) / nb
+            lines += [f"{label:22s} {f'[{low},{high})':>11s} {nb:5d} {tot_time/nb:9.3f} "
+                      f"{sum(rec['len_seq'] for rec in recs)/tot_time:9.0f} {mean('nb_eval'):9.0f} "
+                      f"{max(rec['peak_mb'] for rec in recs):8.1f} {mean('pvv'):6.1f} {mean('sens'):6.1f} "
+                      f"{mean('best_pvv'):8.1f} {mean('best_sens'):9.1f}"]
+    return "\n".join(lines)
+
+
+def export_csv(records, out_file):
+    "legacy csv format: seq,name,struct,nrj,... for RAFFT and seq,len_seq,struct,nrj,nbp for the MFE"
+    with open(out_file, "w") as out:
+        for rec in records:
+            if rec["method"] == "mfe":
+                struct, nrj = rec["structs"][0], rec["nrjs"][0]
+                out.write(f"{rec['seq']},{rec['len_seq']},{struct},{nrj},{struct.count('(')}\n")
+            else:
+                confs = ",".join(f"{st},{nrj:.1f}" for st, nrj in zip(rec["structs"], rec["nrjs"]))
+                out.write(f"{rec['seq']},{rec['name']},{confs}\n")
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('dataset', help="csv file: sequence,structure,name")
+    parser.add_argument('out_file', help="results (one JSON record per line)")
+    parser.add_argument('--method', '-m', choices=["rafft", "mfe"], default="rafft")
+    parser.add_argument('--nb_proc', '-np', type=int, help="number of workers", default=1)
+    parser.add_argument('--n_mode', '-n', type=int, help="positional lags", default=100)
+    parser.add_argument('--max_stack', '-ms', type=int, help="saved structures", default=1)
+    parser.add_argument('--max_branch', '-mb', type=int, help="branches explored", default=100)
+    parser.add_argument('--min_hp', type=int, help="minimum hairpin size", default=3)
+    parser.add_argument('--label', help="name of the run (default: method and settings)")
+    parser.add_argument('--summary', action="store_true", help="only summarize the results")
+    parser.add_argument('--export', help="write the results in the legacy csv format")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    label = args.label if args.label is not None else method_label(args)
+    if not args.summary:
+        dataset = [l.strip().split(",") for l in open(args.dataset)]
+        fold_args = (args.n_mode, args.max_stack, args.max_branch, args.min_hp)
+        run(dataset, args.out_file, label, args.method, fold_args, args.nb_proc)
+
+    records = read_records(args.out_file)
+    print(summary(records))
+    if args.export is not None:
+        export_csv([rec for rec in records if rec["label"] == label], args.export)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Micro-benchmarks of the folding and kinetic kernels.
+
+Each kernel is timed on synthetic random sequences and on sequences of the
+dataset at increasing lengths, and an empirical scaling exponent is fitted on
+log(time) = a log(size) + b. Results can be saved as a baseline, later runs
+are compared to it and flag throughput or complexity regressions.
+
+Kernels: auto_cor, window_slide, get_inner_loop/get_outer_loop,
+eval_one_struct, bfs_pairs (a full fold) and kinetics (sized by the number of
+structures of the landscape).
+
+Usage:
+python bench_kernels.py --quick --save                     # write the baseline
+python bench_kernels.py --quick                            # compare to it
+python bench_kernels.py --dataset benchmark_cleaned_all_length.csv
+"""
+
+import argparse
+import json
+import sys
+from os.path import exists
+from random import Random
+from time import perf_counter
+from numpy import polyfit, log
+from rafft import fold
+from rafft.rafft import window_slide, bfs_pairs
+from rafft.utils import prep_sequence, auto_cor, get_inner_loop, get_outer_loop
+from rafft.utils import eval_one_struct, Glob_parms, Node, Structure
+
+FULL_LENGTHS = [50, 100, 200, 500, 1000, 2000, 5000]
+QUICK_LENGTHS = [50, 100, 200, 400]
+# a full fold is much more expensive than the other kernels
+MAX_FOLD_LEN = {True: 400, False: 2000}
+KIN_STACKS = {True: [2, 4, 8, 16], False: [5, 10, 20, 40, 80]}
+
+
+def random_sequence(len_seq, rng):
+    return "".join(rng.choice("ACGU") for _ in range(len_seq))
+
+
+def dataset_sequence(sequences, len_seq):
+    "sequence of the dataset with the closest length"
+    return min(sequences, key=lambda el: abs(len(el) - len_seq))
+
+
+def time_batch(func, number):
+    start = perf_counter()
+    for _ in range(number):
+        func()
+    return perf_counter() - start
+
+
+def time_it(func, min_time, max_rep=50, min_batch=0.01):
+    """best time per call of FUNC (the minimum is the least noisy); calls are
+    batched to last at least MIN_BATCH and repeated until MIN_TIME is spent
+    """
+    number = 1
+    while time_batch(func, number) < min_batch:
+        number *= 2
+    times, spent = [], 0.0
+    while len(times) < max_rep and (spent < min_time or len(times) < 3):
+        times += [time_batch(func, number)]
+        spent += times[-1]
+    return min(times) / number
+
+
+def helix_pairs(len_seq):
+    "a simple nested structure: one helix per 40 nt window"
+    pairs = []
+    for start in range(0, len_seq - 39, 40):
+        pairs += [(start + k, start + 39 - k) for k in range(15)]
+    return pairs
+
+
+def kernels_on_sequence(sequence, min_time, with_fold):
+    "time of each sequence kernel on one sequence"
+    len_seq = len(sequence)
+    eseq, cseq = prep_sequence(sequence, 3.0, 2.0, 1.0)
+    glob_parms = Glob_parms(sequence, 100, 1, 100, 3, 0.0, False, 37.0, 3.0, 2.0, 1.0)
+    pos_list = list(range(len_seq))
+    cor_l = auto_cor(eseq, cseq)
+    cor_l.sort(key=lambda el: el[1])
+    lags = [pos for pos, _ in cor_l[::-1][:100]]
+    mid = len_seq // 2
+    pairs = helix_pairs(len_seq)
+
+    res = {}
+    res["auto_cor"] = time_it(lambda: auto_cor(eseq, cseq), min_time)
+    res["window_slide"] = time_it(lambda: [window_slide(eseq, cseq, pos, pos_list, 3)
+                                           for pos in lags], min_time)
+    res["inner_outer_loop"] = time_it(lambda: (
+        get_inner_loop(eseq, cseq, mid - 5, mid + 5, 3, pos_list, len_seq),
+        get_outer_loop(eseq, cseq, mid - 5, mid + 5, 3, pos_list, len_seq)), min_time)
+    res["eval_one_struct"] = time_it(lambda: eval_one_struct(pairs, glob_parms), min_time)
+
+    if with_fold:
+        def run_bfs():
+            glob_parms.cor_cache = {}
+            unfold_struct = Structure(node_list=[Node(eseq, cseq, pos_list)], pair_list=[])
+            unfold_struct.str_struct = "."*len_seq
+            bfs_pairs([unfold_struct], glob_parms, step=0, glob_traj=[], seen=set())
+        res["bfs_pairs"] = time_it(run_bfs, min_time, max_rep=5)
+    return res
+
+
+def kinetics_sizes(sequence, stacks, min_time):
+    "time of the kinetics against the number of structures of the landscape"
+    from rafft.rafft_kin import kinetics
+    res = []
+    for max_stack in stacks:
+        _, fast_paths = fold(sequence, 100, max_stack, 1000, traj=True)
+        nb_struct = len(set(st.str_struct for fold_step in fast_paths for st in fold_step))
+        res += [(nb_struct, time_it(lambda: kinetics(fast_paths, 30, 100), min_time, max_rep=5))]
+    return res
+
+
+def fit_exponent(sizes, times):
+    if len(set(sizes)) < 2:
+        return float("nan")
+    return float(polyfit(log(sizes), log(times), 1)[0])
+
+
+def run_benchmarks(args):
+    rng = Random(args.seed)
+    lengths = QUICK_LENGTHS if args.quick else FULL_LENGTHS
+    sequences = []
+    if args.dataset is not None:
+        sequences = [l.strip().split(",")[0] for l in open(args.dataset)]
+
+    results = {}
+    for source in ["synthetic", "dataset"] if sequences else ["synthetic"]:
+        for len_seq in lengths:
+            sequence = random_sequence(len_seq, rng) if source == "synthetic" else \
+                dataset_sequence(sequences, len_seq)
+            with_fold = len(sequence) <= MAX_FOLD_LEN[args.quick]
+            for kernel, val in kernels_on_sequence(sequence, args.min_time, with_fold).items():
+                entry = results.setdefault(f"{kernel}/{source}", {"sizes": [], "times": []})
+                entry["sizes"] += [len(sequence)]
+                entry["times"] += [val]
+            print(f"{source} {len(sequence)} done", file=sys.stderr)
+
+    kin_seq = random_sequence(100 if args.quick else 300, rng)
+    sizes, times = zip(*kinetics_sizes(kin_seq, KIN_STACKS[args.quick], args.min_time))
+    results["kinetics/synthetic"] = {"sizes": list(sizes), "times": list(times)}
+
+    for entry in results.values():
+        entry["exponent"] = fit_exponent(entry["sizes"], entry["times"])
+    return results
+
+
+def compare(results, baseline, time_tol, exp_tol):
+    "flag kernels slower than the baseline or with a higher scaling exponent"
+    flags = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        base_times = dict(zip(base["sizes"], base["times"]))
+        for size, val in zip(entry["sizes"], entry["times"]):
+            if size in base_times and val > (1.0 + time_tol) * base_times[size]:
+                flags += [f"{name} size {size}: {val:.3g} s vs {base_times[size]:.3g} s"]
+        if entry["exponent"] > base["exponent"] + exp_tol:
+            flags += [f"{name} exponent {entry['exponent']:.2f} vs {base['exponent']:.2f}"]
+    return flags
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--dataset', help="csv file: sequence,structure,name")
+    parser.add_argument('--baseline', '-b', help="baseline file", default="bench_kernels_baseline.json")
+    parser.add_argument('--save', action="store_true", help="save the results as the baseline")
+    parser.add_argument('--quick', action="store_true", help="smoke profile (under a minute)")
+    parser.add_argument('--min_time', type=float, help="minimum time spent per measure (s)", default=0.2)
+    parser.add_argument('--time_tol', type=float, help="tolerated slowdown (fraction)", default=0.5)
+    parser.add_argument('--exp_tol', type=float, help="tolerated exponent increase", default=0.3)
+    parser.add_argument('--seed', type=int, help="seed of the synthetic sequences", default=0)
+    parser.add_argument('--out', '-o', help="save the results in this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = run_benchmarks(args)
+
+    print(f"{'kernel':32s} {'exponent':>8s}  times (s) per size")
+    for name, entry in sorted(results.items()):
+        times = " ".join(f"{size}:{val:.2e}" for size, val in zip(entry["sizes"], entry["times"]))
+        print(f"{name:32s} {entry['exponent']:8.2f}  {times}")
+
+    if args.out is not None:
+        with open(args.out, "w") as out:
+            json.dump(results, out, indent=1)
+
+    if args.save:
+        with open(args.baseline, "w") as out:
+            json.dump(results, out, indent=1)
+    elif exists(args.baseline):
+        flags = compare(results, json.load(open(args.baseline)), args.time_tol, args.exp_tol)
+        for flag in flags:
+            print(f"REGRESSION {flag}")
+        if flags:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
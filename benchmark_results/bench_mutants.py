@@ -0,0 +1,74 @@
+"""Benchmark of the single point mutant scan against one fold per mutant.
+
+All the single point mutants of random sequences are folded with scan_mutants
+(the candidate stems of the segments without the mutation are reused from the
+wild-type fold) and with a plain loop of fold(). Both must give the same
+structures and energies, the script exits with an error otherwise.
+
+Usage:
+python bench_mutants.py                        # 60 and 120 nt, 20 saved structures
+python bench_mutants.py -l 100 200 -ms 5
+"""
+
+import argparse
+import sys
+from random import Random
+from time import perf_counter
+from rafft import fold
+from rafft.mutants import scan_mutants, list_mutants
+
+
+def random_sequence(len_seq, rng):
+    return "".join(rng.choice("ACGU") for _ in range(len_seq))
+
+
+def fold_loop(sequence, mutants, args):
+    "best structure and energy of each mutant folded from scratch"
+    res = []
+    for pos, wt, mut in mutants:
+        best = fold(sequence[:pos] + mut + sequence[pos+1:], args.n_mode, args.max_stack)[0]
+        res += [(best.str_struct, best.energy)]
+    return res
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--lengths', '-l', help="sequence lengths", type=int, nargs="+", default=[60, 120])
+    parser.add_argument('--max_stack', '-ms', help="saved structures", type=int, default=20)
+    parser.add_argument('--n_mode', '-n', help="positional lags", type=int, default=100)
+    parser.add_argument('--nb_mut', help="number of mutants per sequence (all if 0)", type=int, default=0)
+    parser.add_argument('--seed', type=int, help="seed of the sequences", default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    rng = Random(args.seed)
+    nb_diff = 0
+    print(f"{'length':>6s} {'mutants':>7s} {'scan (s)':>9s} {'fold (s)':>9s} {'speedup':>7s}")
+    for len_seq in args.lengths:
+        sequence = random_sequence(len_seq, rng)
+        mutants = list_mutants(sequence)
+        if args.nb_mut > 0:
+            mutants = mutants[:args.nb_mut]
+
+        start = perf_counter()
+        _, _, results = scan_mutants(sequence, args.n_mode, args.max_stack, mutants=mutants)
+        scan_time = perf_counter() - start
+        start = perf_counter()
+        ref = fold_loop(sequence, mutants, args)
+        fold_time = perf_counter() - start
+
+        nb_diff += sum((el[3], round(el[4], 2)) != (struct, round(nrj, 2))
+                       for el, (struct, nrj) in zip(results, ref))
+        print(f"{len_seq:6d} {len(mutants):7d} {scan_time:9.2f} {fold_time:9.2f} "
+              f"{fold_time / scan_time:7.2f}")
+    if nb_diff:
+        print(f"{nb_diff} mutants differ from fold()")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
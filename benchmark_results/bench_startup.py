@@ -0,0 +1,67 @@
+"""Startup benchmark: time the import of the folding engine and the CLI help in
+fresh interpreters, and fail if the median exceeds the budget or if the
+plotting/linear algebra stack is loaded by the folding engine.
+
+Usage:
+python bench_startup.py --budget 400 --repeat 7
+"""
+
+import argparse
+import subprocess
+import sys
+from os.path import dirname, realpath, join
+from statistics import median
+from time import perf_counter
+
+ROOT = dirname(dirname(realpath(__file__)))
+LAZY_MODULES = ["matplotlib", "scipy.linalg", "scipy.signal", "rafft.rafft_kin"]
+
+CHECK_LAZY = """
+import sys
+from rafft import fold
+loaded = [m for m in {} if m in sys.modules]
+if loaded:
+    sys.exit("loaded at import: " + ", ".join(loaded))
+""".format(LAZY_MODULES)
+
+
+def run_time(cmd, repeat):
+    "median wall time of a command in ms"
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, env={"PYTHONPATH": ROOT},
+                       cwd=ROOT)
+        times += [(perf_counter() - start) * 1000.0]
+    return median(times)
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--budget', '-b', help="maximum import time above a bare interpreter (ms)", type=float, default=400)
+    parser.add_argument('--repeat', '-r', help="number of runs", type=int, default=7)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    python = sys.executable
+    subprocess.run([python, "-c", CHECK_LAZY], check=True, env={"PYTHONPATH": ROOT}, cwd=ROOT)
+
+    bare = run_time([python, "-c", "pass"], args.repeat)
+    res = {"import": run_time([python, "-c", "from rafft import fold"], args.repeat) - bare,
+           "cli_help": run_time([python, join(ROOT, "bin", "rafft"), "--help"], args.repeat) - bare}
+
+    failed = False
+    for name, val in res.items():
+        status = "ok" if val <= args.budget else "FAIL"
+        failed = failed or val > args.budget
+        print(f"{name:10s} {val:8.1f} ms  (budget {args.budget:.0f} ms) {status}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Check the single precision correlation kernel against double precision.
+
+For each sequence of the dataset, it compares the correlations (maximum error
+relative to the largest correlation), the set of positional lags selected for
+the stem search and the folded structures.
+
+Usage:
+python check_float32.py benchmark_cleaned_all_length.csv --nb_seq 200 -ms 5
+"""
+
+import argparse
+import sys
+from random import Random
+from numpy import abs as npabs, float32, float64
+from rafft import fold
+from rafft.utils import prep_sequence, seq_conv
+from rafft.correlation import lags_from_cor
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('dataset', help="csv file: sequence,structure,name")
+    parser.add_argument('--nb_seq', '-ns', help="number of sequences to check", type=int, default=200)
+    parser.add_argument('--max_stack', '-ms', help="saved structures", type=int, default=5)
+    parser.add_argument('--n_mode', '-n', help="positional lags", type=int, default=100)
+    parser.add_argument('--tol', help="maximum relative correlation error", type=float, default=1e-5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    sequences = [l.strip().split(",")[0] for l in open(args.dataset)]
+    sequences = Random(0).sample(sequences, min(args.nb_seq, len(sequences)))
+
+    max_err, same_lags, same_fold = 0.0, 0, 0
+    for seq in sequences:
+        eseq, cseq = prep_sequence(seq, 3.0, 2.0, 1.0)
+        cor_64 = seq_conv(eseq, cseq, float64)
+        cor_32 = seq_conv(eseq, cseq, float32)
+        max_err = max(max_err, npabs(cor_64 - cor_32).max() / max(1.0, npabs(cor_64).max()))
+        # tied lags may come in a different order
+        lags_64 = set(pos for pos, _ in lags_from_cor(cor_64, args.n_mode))
+        lags_32 = set(pos for pos, _ in lags_from_cor(cor_32, args.n_mode))
+        same_lags += lags_64 == lags_32
+
+        fold_64 = [st.str_struct for st in fold(seq, args.n_mode, args.max_stack)]
+        fold_32 = [st.str_struct for st in fold(seq, args.n_mode, args.max_stack, float32=True)]
+        same_fold += fold_64 == fold_32
+
+    nb_seq = len(sequences)
+    print(f"max relative correlation error {max_err:.2e}")
+    print(f"identical lags {same_lags}/{nb_seq}")
+    print(f"identical structures {same_fold}/{nb_seq}")
+    if max_err > args.tol:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
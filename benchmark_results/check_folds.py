@@ -0,0 +1,78 @@
+"""Regression check of the folds against a reference file.
+
+Random sequences (drawn from a fixed seed) are folded and their final
+structures and energies compared to those saved in the reference file. The
+reference (fold_reference.csv) was saved with the original implementation of
+the stem search (scipy.signal.convolve): tied correlation lags must keep their
+order, one of its sequences folds differently when they do not. Run the script
+from another tree (PYTHONPATH) with --save to write a new reference.
+
+Usage:
+python check_folds.py                          # compare to fold_reference.csv
+python check_folds.py --save                   # write the reference
+"""
+
+import argparse
+import sys
+from os.path import dirname, join, realpath
+from random import Random
+from rafft import fold
+
+REFERENCE = join(dirname(realpath(__file__)), "fold_reference.csv")
+
+
+def random_sequences(nb_seq, min_len, max_len, seed):
+    rng = Random(seed)
+    return ["".join(rng.choice("ACGU") for _ in range(rng.randint(min_len, max_len)))
+            for _ in range(nb_seq)]
+
+
+def fold_line(seq, args):
+    "sequence then structure,energy of each final structure"
+    structures = fold(seq, args.n_mode, args.max_stack)
+    return ",".join([seq] + [f"{st.str_struct},{st.energy:.2f}" for st in structures])
+
+
+def parse_arguments():
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--reference', '-r', help="reference file", default=REFERENCE)
+    parser.add_argument('--save', action="store_true", help="write the reference instead of checking it")
+    parser.add_argument('--nb_seq', '-ns', help="number of sequences", type=int, default=150)
+    parser.add_argument('--min_len', type=int, help="minimum length", default=100)
+    parser.add_argument('--max_len', type=int, help="maximum length", default=300)
+    parser.add_argument('--seed', type=int, help="seed of the sequences", default=2)
+    parser.add_argument('--max_stack', '-ms', help="saved structures", type=int, default=5)
+    parser.add_argument('--n_mode', '-n', help="positional lags", type=int, default=100)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.save:
+        sequences = random_sequences(args.nb_seq, args.min_len, args.max_len, args.seed)
+        with open(args.reference, "w") as out:
+            out.write(f"# max_stack={args.max_stack} n_mode={args.n_mode}\n")
+            for seq in sequences:
+                out.write(fold_line(seq, args) + "\n")
+        return
+
+    lines = [l.strip() for l in open(args.reference)]
+    header, reference = lines[0], lines[1:]
+    for el in header[1:].split():
+        key, val = el.split("=")
+        setattr(args, key, int(val))
+    nb_diff = 0
+    for ref in reference:
+        res = fold_line(ref.split(",")[0], args)
+        if res != ref:
+            nb_diff += 1
+            print(f"expected {ref}\nfound    {res}")
+    print(f"identical folds {len(reference) - nb_diff}/{len(reference)}")
+    if nb_diff:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
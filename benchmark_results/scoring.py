@@ -1,12 +1,19 @@
 """score multiple structures for one input
+
+PPV and sensitivity are computed from pair tables, all the structures predicted
+for a sequence are scored in one vectorized pass. As in the RNAstructure
+scorer, a predicted pair (i, j) matches a reference pair when one of its ends
+slips by one position: (i±1, j) or (i, j±1) (disabled with --no_slip).
 """
 
 from multiprocessing import Pool
-import subprocess
-from math import isnan
 import argparse
-from os import system
+from numpy import full, zeros, array, bincount, int32
 from RNA import energy_of_struct
+from rafft.utils import struct_matrix, pair_arrays
+
+# (i, j) shifts accepted when a pair is compared
+SLIPS = [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)]
 
 
 def paired_positions(structure):
@@ -28,11 +35,48 @@ def paired_positions(structure):
     return pairs
 
 
-def read_true_struct(infile="benchmark_cleaned.csv"):
+def score_structures(structures, ref_struct, slip=True):
+    """PPV and sensitivity (in %) of each predicted structure against the
+    reference one (which may contain pseudoknots)
+
+    output:
+    pvv, sens = arrays over the structures
+    """
+    nb_struct, len_seq = len(structures), len(ref_struct)
+    shifts = SLIPS if slip else SLIPS[:1]
+    ref_pairs = array(paired_positions(ref_struct), dtype=int32).reshape(-1, 2)
+    # pair tables padded by one position on each side, -2 marks unpaired
+    ref_pt = full(len_seq + 2, -2, dtype=int32)
+    ref_pt[ref_pairs[:, 0] + 1], ref_pt[ref_pairs[:, 1] + 1] = ref_pairs[:, 1], ref_pairs[:, 0]
+
+    sids, pos_i, pos_j = pair_arrays(struct_matrix(structures))
+    pred_pt = full((nb_struct, len_seq + 2), -2, dtype=int32)
+    pred_pt[sids, pos_i + 1], pred_pt[sids, pos_j + 1] = pos_j, pos_i
+
+    # predicted pairs found in the reference
+    correct = zeros(len(sids), dtype=bool)
+    for d_i, d_j in shifts:
+        correct |= ref_pt[pos_i + d_i + 1] == pos_j + d_j
+    nb_pred = bincount(sids, minlength=nb_struct)
+    nb_correct = bincount(sids, weights=correct, minlength=nb_struct)
+
+    # reference pairs found in each prediction
+    found = zeros((nb_struct, len(ref_pairs)), dtype=bool)
+    for d_i, d_j in shifts:
+        found |= pred_pt[:, ref_pairs[:, 0] + d_i + 1] == ref_pairs[:, 1] + d_j
+    nb_found = found.sum(axis=1)
+
+    pvv = 100.0 * nb_correct / nb_pred.clip(min=1)
+    sens = 100.0 * nb_found / max(1, len(ref_pairs))
+    return pvv, sens
+
+
+def read_true_struct(infile="benchmark_cleaned_all_length.csv"):
+    "reference structures by name"
     results = {}
     for l in open(infile):
         seq, struct, name = l.strip().split(",")
-        results[seq] = (struct, name)
+        results[name] = struct
     return results
 
 
@@ -43,55 +87,41 @@ def read_csv(infile):
     return results
 
 
-def create_ct_file(struct, sequence, out_file, name):
-    nb_base = len(sequence)
-    pair_list = paired_positions(struct)
-    pair_co = {}
-    for pi, pj in pair_list:
-        pair_co[pi] = pj
-        pair_co[pj] = pi
-
-    with open(out_file, "w") as out:
-        out.write(f"{nb_base} {name}\n")
-        for i, nuc in enumerate(sequence):
-            base_id = i+1
-            id_m1, id_p1 = i, i+2
-            bp_id = pair_co[i]+1 if i in pair_co else 0
-            nat_id = base_id
-            out.write(f"{base_id} {nuc} {id_m1} {id_p1} {bp_id} {nat_id}\n")
-
-            
-def read_log_file(infile):
-    for l in open(infile):
-        if l.startswith("PPV"):
-            pvv = float(l.strip().split()[-1][:-1])
-        if l.startswith("Sensitivity"):
-            sensitivity = float(l.strip().split()[-1][:-1])
-            # nothing predicted
-            if isnan(sensitivity):
-                sensitivity = 0.0
-    return pvv, sensitivity
+def init_worker(true_str, slip, mode):
+    global TRUE_STR, SLIP, MODE
+    TRUE_STR, SLIP, MODE = true_str, slip, mode
 
 
 def test_one_seq(record):
-    cmd_line = "/clusterhome/vopuu/programs/RNAstructure/exe/scorer {} {} {}"
-    # cmd_line = "../RNAstructure/exe/scorer {} {} {}"
-    raw_file = "../raw_data/archiveII/{}.ct"
-    val = record
-    seq, name, conf = val[0], val[1], val[2:]
-    max_pvv, max_sens = 0, 0
-    max_struct = "."*len(seq)
-    for istruct, iscore in zip(range(len(conf))[::2], range(len(conf))[1::2]):
-        struct, score = conf[istruct], conf[iscore]
-        create_ct_file(struct, seq, f"./log/{name}_pred.ct", name+"_pred")
-        pred_cmd_line = cmd_line.format(f"./log/{name}_pred.ct", raw_file.format(name), f"./log/{name}_pred.log").split()
-        subprocess.Popen(pred_cmd_line, stdout=subprocess.PIPE, env={'DATAPATH': '/clusterhome/vopuu//programs/RNAstructure/data_tables/'}).communicate()
-        pred_pvv, pred_sens = read_log_file(f"./log/{name}_pred.log")
-        if pred_pvv >= max_pvv:
-            max_pvv, max_sens, max_struct = pred_pvv, pred_sens, struct
-        if ONE:
-            break
-    return max_pvv, max_sens, max_struct, seq, name
+    """score a record seq,name,struct,nrj,struct,nrj,... MODE is one of first
+    (first structure), last (last structure) or best (best PPV)
+    """
+    seq, name, conf = record[0], record[1], record[2:]
+    structures = conf[0::2]
+    if MODE == "first":
+        structures = structures[:1]
+    elif MODE == "last":
+        structures = structures[-1:]
+    pvv, sens = score_structures(structures, TRUE_STR[name], SLIP)
+    # the last structure with the highest PPV
+    best = len(pvv) - 1 - int(pvv[::-1].argmax())
+    return float(pvv[best]), float(sens[best]), structures[best], seq, name
+
+
+def score_file(input_file, output_file, true_file, mode="best", slip=True, nb_proc=4):
+    prediction = read_csv(input_file)
+    true_str = read_true_struct(true_file)
+    with Pool(nb_proc, initializer=init_worker, initargs=(true_str, slip, mode)) as pool:
+        results = pool.map(test_one_seq, prediction,
+                           chunksize=max(1, len(prediction) // (4 * nb_proc)))
+
+    with open(output_file, "w") as out:
+        out.write("seq,len_seq,struct,nrj,nbp,pvv,sens,name\n")
+        for pred_pvv, pred_sens, pred_struct, seq, name in results:
+            pred_nrj = energy_of_struct(seq, pred_struct)
+            len_seq = len(seq)
+            nbbp = pred_struct.count("(")
+            out.write(f"{seq},{len_seq},{pred_struct},{pred_nrj},{nbbp},{pred_pvv},{pred_sens},{name}\n")
 
 
 def parse_arguments():
@@ -102,30 +132,15 @@ def parse_arguments():
     parser.add_argument('output_file', help="input")
     parser.add_argument('true_struct', help="input")
     parser.add_argument('--one', action="store_true", help="best structure only")
+    parser.add_argument('--no_slip', action="store_true", help="exact pairs only")
+    parser.add_argument('--nb_proc', '-np', type=int, help="number of processes", default=4)
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
-    global ONE
-    ONE = args.one
-    prediction = read_csv(args.input_file)
-    true_str = read_true_struct(args.true_struct)
-    system("rm -r log")
-    system("mkdir -p log")
-    pool = Pool(4)
-    # results = map(test_one_seq, prediction[:2])
-    results = pool.map(test_one_seq, prediction)
-
-    with open(args.output_file, "w") as out:
-        out.write("seq,len_seq,struct,nrj,nbp,pvv,sens,name\n")
-        # for seq, (struct, name) in true_str.items():
-        for pred_pvv, pred_sens, pred_struct, seq, name in results:
-            # if seq in prediction:
-            pred_nrj = energy_of_struct(seq, pred_struct)
-            len_seq = len(seq)
-            nbbp = pred_struct.count("(")
-            out.write(f"{seq},{len_seq},{pred_struct},{pred_nrj},{nbbp},{pred_pvv},{pred_sens},{name}\n")
+    score_file(args.input_file, args.output_file, args.true_struct,
+               "first" if args.one else "best", not args.no_slip, args.nb_proc)
 
 
 if __name__ == '__main__':
@@ -1,2 +1,9 @@
 from rafft.rafft import fold
-from rafft.rafft_kin import kinetics
+
+
+def __getattr__(name):
+    # the kinetics pulls scipy.linalg, only load it when asked for
+    if name in ["kinetics", "fold_kinetics"]:
+        import rafft.rafft_kin
+        return getattr(rafft.rafft_kin, name)
+    raise AttributeError(f"module 'rafft' has no attribute '{name}'")
@@ -0,0 +1,67 @@
+"""Base pair probabilities estimated from the structures visited by RAFFT.
+
+The distinct structures (final ones and the trajectory) are weighted by
+exp(-E/kT) and the weights of the structures containing a pair are summed. The
+pairs of all the structures are extracted at once from a matrix of
+dot-brackets, by blocks of rows to bound the memory.
+"""
+
+from numpy import array, exp, savez_compressed
+from scipy.sparse import coo_matrix, csr_matrix
+from rafft.rafft import fold
+from rafft.utils import struct_matrix, pair_arrays
+
+KT = 0.61
+
+
+def pair_probabilities(structures, energies, kt=KT, block_size=1 << 24):
+    """Boltzmann-weighted pair probabilities of a set of structures.
+
+    input:
+    structures = list of dot-brackets (duplicates are counted once)
+    energies = their energies
+
+    output:
+    bpp = sparse (len x len) matrix, bpp[i, j] with i < j
+    """
+    # keep the first occurrence of each structure
+    uniq = dict(zip(reversed(structures), reversed(energies)))
+    smat = struct_matrix(list(uniq.keys()))
+    energies = array(list(uniq.values()), dtype=float)
+
+    weights = exp(-(energies - energies.min())/kt)
+    weights /= weights.sum()
+
+    nb_struct, len_seq = smat.shape
+    bpp = csr_matrix((len_seq, len_seq))
+    # number of structures per block
+    step = max(1, block_size // max(1, len_seq))
+    for start in range(0, nb_struct, step):
+        sids, pos_i, pos_j = pair_arrays(smat[start:start+step])
+        block = coo_matrix((weights[start:start+step][sids], (pos_i, pos_j)),
+                           shape=(len_seq, len_seq))
+        bpp = bpp + block.tocsr()
+    return bpp
+
+
+def fold_bpp(sequence, kt=KT, **fold_args):
+    "fold with trajectory and estimate the pair probabilities from all the structures"
+    fold_args["traj"] = True
+    structures, trajectory = fold(sequence, **fold_args)
+    all_struct = [st for fold_step in trajectory for st in fold_step] + structures
+    return pair_probabilities([st.str_struct for st in all_struct],
+                              [st.energy for st in all_struct], kt)
+
+
+def write_bpp(bpp, out_file):
+    """Save the probabilities: a .npz file with the coordinates, or a text list
+    of 'i j p' with 1-based positions.
+    """
+    bpp = bpp.tocoo()
+    if out_file.endswith(".npz"):
+        savez_compressed(out_file, i=bpp.row.astype("int32"), j=bpp.col.astype("int32"),
+                         p=bpp.data.astype("float32"), shape=array(bpp.shape))
+    else:
+        with open(out_file, "w") as out:
+            for pi, pj, prob in zip(bpp.row, bpp.col, bpp.data):
+                out.write(f"{pi+1} {pj+1} {prob:.6g}\n")
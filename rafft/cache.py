@@ -0,0 +1,172 @@
+"""Persistent cache of folding results.
+
+Results are stored in a SQLite file, keyed by a hash of the sequence, all the
+folding parameters and the ViennaRNA version. The final structures are always
+stored, the trajectories only if they were computed. When the file grows above
+its maximum size, the least recently used entries are evicted: the total size
+is kept in a meta row, and the access times are only updated when they are
+older than ACCESS_RESOLUTION, so reads rarely write.
+
+The cache is opt-in: give a path (or a ResultCache) to fold(), or set the
+RAFFT_CACHE environment variable.
+"""
+
+import json
+import sqlite3
+import zlib
+from hashlib import sha256
+from os import environ, getpid
+from time import time
+from RNA import __version__ as VRNA_VERSION
+from rafft.utils import paired_positions, Structure
+
+DEFAULT_MAX_SIZE = 1 << 30
+# seconds below which a read does not update the access time of an entry
+ACCESS_RESOLUTION = 60.0
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    structures BLOB NOT NULL,
+    trajectory BLOB,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL)"""
+
+META_SCHEMA = """CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL)"""
+
+
+class ResultCache:
+    "SQLite store of folding results, safe for concurrent processes"
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, timeout=60.0):
+        self.path, self.max_size, self.timeout = path, max_size, timeout
+        self.conn, self.pid = None, None
+        self.hits, self.misses = 0, 0
+
+    def connect(self):
+        "one connection per process, forked workers open their own"
+        if self.conn is None or self.pid != getpid():
+            self.conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                        isolation_level=None)
+            # WAL lets readers work while a writer commits
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(SCHEMA)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS access ON results(last_access)")
+            self.conn.execute(META_SCHEMA)
+            # files created before the meta table: the total is computed once
+            self.conn.execute("INSERT OR IGNORE INTO meta SELECT 'total_size', "
+                              "COALESCE(SUM(size), 0) FROM results")
+            self.pid = getpid()
+        return self.conn
+
+    def __getstate__(self):
+        # connections can't be shared between processes
+        state = self.__dict__.copy()
+        state["conn"], state["pid"] = None, None
+        return state
+
+    def get(self, key, traj=False):
+        """Return (structures, trajectory) as lists of (structure, energy) or None
+        if missing. A request for the trajectory misses if it was not stored.
+        """
+        conn = self.connect()
+        row = conn.execute("SELECT structures, trajectory, last_access FROM results WHERE key=?",
+                           (key,)).fetchone()
+        if row is None or (traj and row[1] is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time()
+        if now - row[2] > ACCESS_RESOLUTION:
+            conn.execute("UPDATE results SET last_access=? WHERE key=?", (now, key))
+        structures = unpack(row[0])
+        trajectory = unpack(row[1]) if row[1] is not None else None
+        return structures, trajectory
+
+    def put(self, key, structures, trajectory=None):
+        "store a result and evict old ones if the file is too large"
+        blob_st = pack(structures)
+        blob_tr = pack(trajectory) if trajectory is not None else None
+        size = len(blob_st) + (len(blob_tr) if blob_tr is not None else 0)
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM results WHERE key=?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                         (key, blob_st, blob_tr, size, time()))
+            self.add_size(conn, size - (old[0] if old is not None else 0))
+            self.evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add_size(self, conn, delta):
+        conn.execute("UPDATE meta SET value=value+? WHERE name='total_size'", (delta,))
+
+    def total_size(self):
+        "size of the stored results (bytes, compressed)"
+        return self.connect().execute("SELECT value FROM meta WHERE name='total_size'").fetchone()[0]
+
+    def evict(self, conn):
+        "remove the least recently used results above the maximum size"
+        total = conn.execute("SELECT value FROM meta WHERE name='total_size'").fetchone()[0]
+        if total <= self.max_size:
+            return
+        to_del, freed = [], 0
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+            if total - freed <= self.max_size:
+                break
+            to_del += [(key,)]
+            freed += size
+        conn.executemany("DELETE FROM results WHERE key=?", to_del)
+        self.add_size(conn, -freed)
+
+    def clear(self):
+        "remove all the results"
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM results")
+        conn.execute("UPDATE meta SET value=0 WHERE name='total_size'")
+        conn.execute("COMMIT")
+
+
+def pack(results):
+    return zlib.compress(json.dumps(results).encode())
+
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob).decode())
+
+
+def result_key(sequence, nb_mode, max_stack, max_branch, min_hp, min_nrj, temp,
+               gc_wei, au_wei, gu_wei):
+    "hash of everything the result depends on"
+    parms = [sequence, nb_mode, max_stack, max_branch, min_hp, float(min_nrj),
+             float(temp), float(gc_wei), float(au_wei), float(gu_wei), VRNA_VERSION]
+    return sha256(json.dumps(parms).encode()).hexdigest()
+
+
+OPEN_CACHES = {}
+
+
+def get_cache(cache):
+    "resolve the cache argument of fold(): None, a path or a ResultCache"
+    if cache is None:
+        cache = environ.get("RAFFT_CACHE")
+        if not cache:
+            return None
+    if isinstance(cache, ResultCache):
+        return cache
+    if cache not in OPEN_CACHES:
+        OPEN_CACHES[cache] = ResultCache(cache)
+    return OPEN_CACHES[cache]
+
+
+def to_struct(str_struct, energy):
+    "rebuild a structure from the cache"
+    struct = Structure(node_list=[], pair_list=paired_positions(str_struct))
+    struct.str_struct, struct.energy = str_struct, energy
+    return struct
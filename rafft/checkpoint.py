@@ -0,0 +1,92 @@
+"""Save and restore the state of the breadth-first search.
+
+A checkpoint is a gzip-compressed pickle of plain python objects: the folding
+parameters, the current step, the frontier, the trajectory, the set of seen
+structures and the folding graph when one is built. The unpaired segments are stored as positions only, their encoding
+is rebuilt from the sequence when the fold is resumed.
+"""
+
+import gzip
+import pickle
+from os import replace
+from rafft.utils import paired_positions, Node, Structure
+
+CHECKPOINT_VERSION = 1
+
+
+def fold_parameters(glob_parms):
+    "parameters that must match to resume a fold"
+    return {"sequence": glob_parms.sequence, "nb_mode": glob_parms.nb_mode,
+            "max_stack": glob_parms.max_stack, "max_branch": glob_parms.max_branch,
+            "min_hp": glob_parms.min_hp, "min_nrj": glob_parms.min_nrj,
+            "temp": glob_parms.temp, "gc_wei": glob_parms.gc_wei,
+            "au_wei": glob_parms.au_wei, "gu_wei": glob_parms.gu_wei,
+            "cor_dtype": glob_parms.cor_dtype.__name__}
+
+
+def save_checkpoint(out_file, glob_tree, glob_traj, seen, step, glob_parms):
+    "write the state at the beginning of STEP"
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "parameters": fold_parameters(glob_parms),
+        "step": step,
+        "frontier": [(struct.str_struct, struct.energy, struct.pair_list,
+                      [node.pos_list for node in struct.node_list])
+                     for struct in glob_tree],
+        "trajectory": [[(struct.str_struct, struct.energy) for struct in fold_step]
+                       for fold_step in glob_traj],
+        "seen": list(seen),
+        "graph": glob_parms.graph.state() if glob_parms.graph is not None else None}
+
+    # write in a temporary file first so a preempted job never leaves a
+    # truncated checkpoint behind
+    tmp_file = f"{out_file}.tmp"
+    with gzip.open(tmp_file, "wb", compresslevel=3) as out:
+        pickle.dump(state, out, protocol=pickle.HIGHEST_PROTOCOL)
+    replace(tmp_file, out_file)
+
+
+def load_checkpoint(in_file, glob_parms, eseq, cseq):
+    """Read a checkpoint and rebuild the search state.
+
+    output:
+    glob_tree = frontier of the search
+    glob_traj = trajectory up to the previous step
+    seen = set of seen structures
+    step = step to resume from
+    """
+    with gzip.open(in_file, "rb") as inp:
+        state = pickle.load(inp)
+
+    if state["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"unsupported checkpoint version {state['version']}")
+    # checkpoints of version 1 without the precision were all in float64
+    state["parameters"].setdefault("cor_dtype", "float64")
+    if state["parameters"] != fold_parameters(glob_parms):
+        raise ValueError(f"{in_file} was created with different folding parameters")
+
+    len_seq = glob_parms.len_seq
+    glob_tree = []
+    for str_struct, energy, pair_list, segments in state["frontier"]:
+        node_list = []
+        for pos_list in segments:
+            # the complementary strand is mirrored
+            cpos_list = [len_seq - pos - 1 for pos in pos_list[::-1]]
+            node_list += [Node(eseq[:, pos_list], cseq[:, cpos_list], pos_list)]
+        struct = Structure(node_list=node_list, pair_list=pair_list)
+        struct.str_struct, struct.energy = str_struct, energy
+        glob_tree += [struct]
+
+    glob_traj = []
+    for fold_step in state["trajectory"]:
+        tmp_step = []
+        for str_struct, energy in fold_step:
+            struct = Structure(node_list=[], pair_list=paired_positions(str_struct))
+            struct.str_struct, struct.energy = str_struct, energy
+            tmp_step += [struct]
+        glob_traj += [tmp_step]
+
+    if glob_parms.graph is not None and state.get("graph") is not None:
+        glob_parms.graph.load_state(state["graph"])
+
+    return glob_tree, glob_traj, set(state["seen"]), state["step"]
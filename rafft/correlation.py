@@ -0,0 +1,109 @@
+"""Correlation kernel of the stem search.
+
+Sequences are encoded through a lookup table: lowercase letters are accepted,
+T is read as U and any other IUPAC character is an unknown nucleotide that
+never pairs. The correlation of the two strands is computed with real FFTs
+padded to a 5-smooth size; the complementary strand is a mix of the channels of
+the forward one, so its transform is derived from the forward transform, and the
+four channels are summed in the frequency domain so only one inverse transform
+is needed. Computations are done in float64 by
+default or in float32 on demand.
+"""
+
+from functools import lru_cache
+from numpy import array, zeros, flip, arange, minimum, argsort, float64, uint8
+from numpy import frombuffer, around
+from numpy.fft import rfft, irfft
+
+# decimals of the correlations kept to rank the lags
+COR_DECIMALS = 9
+
+# nucleotide codes: A, G, C, U, unknown
+A_, G_, C_, U_, N_ = range(5)
+ENCODE_LUT = zeros(256, dtype=uint8) + N_
+for nucs, code in [("Aa", A_), ("Gg", G_), ("Cc", C_), ("UuTt", U_)]:
+    for nuc in nucs:
+        ENCODE_LUT[ord(nuc)] = code
+
+# one-hot encoding of the forward strand
+ENCODING = array([[1., 0, 0, 0], [0, 1., 0, 0], [0, 0, 1., 0], [0, 0, 0, 1.], [0, 0, 0, 0]])
+
+
+def encode(sequence):
+    "nucleotide codes of a sequence"
+    return ENCODE_LUT[frombuffer(sequence.encode("ascii"), dtype=uint8)]
+
+
+def comp_encoding(gc_wei, au_wei, gu_wei):
+    "encoding of the complementary strand, weighted by pair types"
+    return array([[0, 0, 0, au_wei], [0, 0, gc_wei, gu_wei], [0, gc_wei, 0, 0],
+                  [au_wei, gu_wei, 0, 0], [0, 0, 0, 0]])
+
+
+def encode_strands(sequence, gc_wei=1.0, au_wei=1.0, gu_wei=1.0):
+    """Encode the sequence into two mirror strands
+    """
+    codes = encode(sequence)
+    e_seq = ENCODING[codes].T
+    c_seq = flip(comp_encoding(gc_wei, au_wei, gu_wei)[codes].T, axis=1)
+    return e_seq, c_seq
+
+
+@lru_cache(maxsize=None)
+def next_fast_len(target):
+    "smallest 2^a 3^b 5^c >= target"
+    best = 2 * target
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # complete with the smallest power of two
+            p2 = p35
+            while p2 < target:
+                p2 *= 2
+            best = min(best, p2)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+@lru_cache(maxsize=256)
+def overlap_norm(len_seq, pad=1.0):
+    "number of overlapping positions (+ pad) for each lag"
+    lags = arange(2*len_seq-1)
+    return minimum(lags, 2*len_seq-2-lags) + pad
+
+
+@lru_cache(maxsize=16)
+def pair_weights(gc_wei, au_wei, gu_wei, dtype=float64):
+    "4x4 weights of the pairs: the unflipped cseq is pair_weights.T @ seq"
+    return comp_encoding(gc_wei, au_wei, gu_wei)[:4].astype(dtype)
+
+
+def correlate(seq, cseq, dtype=float64, weights=None):
+    """Correlation between the two strands for every lag, the sum over the 4
+    channels of the full convolution of seq with the unflipped cseq. With the
+    pair WEIGHTS of the encoding (see pair_weights), the transform of the
+    unflipped cseq is the one of seq mixed by the weights, so only seq is
+    transformed.
+    """
+    len_seq = seq.shape[1]
+    len_cor = 2*len_seq - 1
+    size = next_fast_len(len_cor)
+    f_seq = rfft(seq.astype(dtype, copy=False), size, axis=1)
+    if weights is None:
+        f_cseq = rfft(flip(cseq, axis=1).astype(dtype, copy=False), size, axis=1)
+    else:
+        f_cseq = weights.T @ f_seq
+    return irfft((f_seq * f_cseq).sum(axis=0), size)[:len_cor]
+
+
+def lags_from_cor(cor, nb_mode, pad=1.0):
+    """Positional lags with the highest normalized correlation, best first; ties
+    are ranked by decreasing lag. The raw correlations are rounded to
+    COR_DECIMALS first: the FFT adds rounding noise to values that are exact
+    (integers with integer weights), which would break the ties at random.
+    """
+    norm_c = around(cor, COR_DECIMALS) / overlap_norm(len(cor) // 2 + 1, pad)
+    order = argsort(norm_c, kind="stable")[::-1][:nb_mode]
+    return [[int(i), float(norm_c[i])] for i in order]
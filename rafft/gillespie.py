@@ -0,0 +1,231 @@
+"""Stochastic simulation of the kinetic model (Gillespie algorithm).
+
+The rates are those of rafft_kin.get_transition_mat. The jump probabilities of
+all the states are stored in one cumulative table, in the CSR order of the
+transition matrix: the next state of a trajectory in state i is found by a
+binary search in the slice of i, for all the trajectories at once. Trajectories
+are run by chunks of CHUNK_SIZE, each chunk drawing from its own seed spawned
+from the main one, so the results do not depend on the number of processes.
+
+The populations on a time grid are accumulated as differences (+1 on the first
+time point a trajectory spends in a state, -1 after the last one) summed once
+at the end. First-passage times to a set of target states are recorded on the
+way; they are censored (inf) at the end of the time grid.
+
+The cost grows with the number of jumps: before running, the number of jumps a
+trajectory can make (time horizon x largest output rate) is compared to the
+jump limit, and trajectories stopped at the limit are reported on stderr.
+"""
+
+from multiprocessing import Pool
+from sys import stderr
+from numpy import array, zeros, full, arange, concatenate, cumsum, diff
+from numpy import isinf, inf, int64, ndarray
+from numpy.random import SeedSequence, default_rng
+import numpy as np
+
+# above this ratio of the expected jumps to the jump limit, simulations are refused
+MAX_JUMP_RATIO = 10.0
+# above this number of jumps of all the trajectories (a few ns each), a warning
+# is printed before running
+SLOW_JUMPS = 5e9
+
+
+class RateTable:
+    "cumulative jump probabilities and total output rate of each state"
+
+    def __init__(self, transition_mat):
+        from scipy.sparse import csr_matrix
+        if isinstance(transition_mat, ndarray):
+            transition_mat = array(transition_mat, dtype=float)
+        rates = csr_matrix(transition_mat, dtype=float, copy=True)
+        rates.setdiag(0.0)
+        rates.eliminate_zeros()
+        rates.sort_indices()
+        self.ptr, self.targets = rates.indptr, rates.indices
+        rows = np.repeat(arange(rates.shape[0]), diff(self.ptr))
+        self.out_rates = np.bincount(rows, weights=rates.data, minlength=rates.shape[0])
+        # normalized per state, the table grows by one per state, which keeps
+        # the rounding errors small for any range of rates
+        self.cum = cumsum(rates.data / self.out_rates[rows])
+        self.cum_start = concatenate(([0.0], self.cum))[self.ptr[:-1]]
+
+    def __len__(self):
+        return len(self.out_rates)
+
+    def jump(self, states, rand):
+        "next states of STATES (which must have output rates) for uniform draws RAND"
+        start, stop = self.ptr[states], self.ptr[states + 1]
+        low, high = self.cum_start[states], self.cum[stop - 1]
+        nxt = self.cum.searchsorted(low + rand * (high - low), side="right")
+        # rounding at the end of a slice
+        return self.targets[np.minimum(np.maximum(nxt, start), stop - 1)]
+
+
+def run_chunk(table, init_pop, times, nb_traj, seed, targets=None, max_jumps=10**6,
+              stop_at_targets=False):
+    """NB_TRAJ trajectories from states drawn in INIT_POP, with STOP_AT_TARGETS
+    they end in the targets (only the first-passage times are then meaningful)
+
+    output:
+    counts = number of trajectories in each state at each time, array (len(times), nb_struct)
+    fpt = first time in a target state of each trajectory (inf if not reached)
+    nb_truncated = trajectories stopped after MAX_JUMPS jumps, kept in their last state
+    """
+    rng = default_rng(seed)
+    nb_struct, nb_time = len(table), len(times)
+    state = rng.choice(nb_struct, size=nb_traj, p=init_pop)
+    clock = zeros(nb_traj)
+    fpt = full(nb_traj, inf)
+    if targets is not None:
+        fpt[targets[state]] = 0.0
+    delta = zeros((nb_time + 1, nb_struct), dtype=int64)
+    active = arange(nb_traj)
+    if stop_at_targets:
+        active = active[~targets[state]]
+    nb_jumps, nb_truncated = 0, 0
+    while len(active):
+        cur = state[active]
+        with np.errstate(divide="ignore"):
+            # absorbing states: infinite waiting time
+            nxt_clock = clock[active] + rng.standard_exponential(len(active)) / table.out_rates[cur]
+        if nb_jumps == max_jumps:
+            nxt_clock[:] = inf
+            nb_truncated = len(active)
+        # time points in [clock, nxt_clock) are spent in the current state
+        first = times.searchsorted(clock[active], side="left")
+        last = times.searchsorted(nxt_clock, side="left")
+        spent = first < last
+        np.add.at(delta, (first[spent], cur[spent]), 1)
+        np.add.at(delta, (last[spent], cur[spent]), -1)
+
+        moving = nxt_clock <= times[-1]
+        active, cur, nxt_clock = active[moving], cur[moving], nxt_clock[moving]
+        nxt = table.jump(cur, rng.random(len(active)))
+        if targets is not None:
+            hit = targets[nxt] & isinf(fpt[active])
+            fpt[active[hit]] = nxt_clock[hit]
+        state[active], clock[active] = nxt, nxt_clock
+        if stop_at_targets:
+            active = active[~targets[nxt]]
+        nb_jumps += 1
+    return cumsum(delta, axis=0)[:nb_time], fpt, nb_truncated
+
+
+def init_worker(*chunk_args):
+    "one copy of the rate table per worker"
+    global CHUNK_ARGS
+    CHUNK_ARGS = chunk_args
+
+
+def run_worker_chunk(chunk):
+    nb_traj, seed = chunk
+    table, init_pop, times, *args = CHUNK_ARGS
+    return run_chunk(table, init_pop, times, nb_traj, seed, *args)
+
+
+class StochasticPropagator:
+    """Populations of the master equation estimated from NB_TRAJ stochastic
+    trajectories, with the interface of rafft_kin.Propagator.
+
+    The cost grows with the number of jumps, not with the size of the model:
+    fast exchanges between nearly degenerate structures make long time grids
+    expensive. Trajectories are stopped after MAX_JUMPS jumps, frozen in their
+    last state (counted in self.nb_truncated over all the simulations, with a
+    warning), a simulation whose horizon allows more than MAX_JUMP_RATIO times
+    MAX_JUMPS jumps is refused (ValueError), and one whose trajectories can make
+    more than SLOW_JUMPS jumps in total is announced by a warning.
+    """
+
+    def __init__(self, transition_mat, nb_traj=1000, seed=None, nb_proc=1,
+                 chunk_size=2048, max_jumps=10**6):
+        self.table = RateTable(transition_mat)
+        self.nb_traj, self.seed, self.nb_proc = nb_traj, seed, nb_proc
+        self.chunk_size, self.max_jumps = chunk_size, max_jumps
+        self.nb_truncated = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def max_jumps_estimate(self, max_time):
+        "upper bound of the jumps of a trajectory up to MAX_TIME"
+        return max_time * self.table.out_rates.max() if len(self) else 0.0
+
+    def check_cost(self, max_time):
+        "refuse or warn when the trajectories can make too many jumps"
+        nb_jumps = self.max_jumps_estimate(max_time)
+        if nb_jumps > MAX_JUMP_RATIO * self.max_jumps:
+            raise ValueError(f"up to {nb_jumps:.1e} jumps per trajectory until t={max_time:.2e}, "
+                             f"far above the limit of {self.max_jumps:.0e}: lower the max time "
+                             "or use the dense/sparse backend")
+        if nb_jumps > self.max_jumps:
+            print(f"warning: up to {nb_jumps:.1e} jumps per trajectory until t={max_time:.2e}, "
+                  f"trajectories may be stopped at {self.max_jumps:.0e} jumps", file=stderr)
+        total = self.nb_traj * min(nb_jumps, self.max_jumps)
+        if total > SLOW_JUMPS:
+            print(f"warning: up to {total:.1e} jumps for {self.nb_traj} trajectories, the "
+                  "simulation can take minutes (lower the max time or the trajectories)",
+                  file=stderr)
+
+    def simulate(self, init_pop, times, targets=None, stop_at_targets=False):
+        """run the trajectories on the (sorted) time grid TIMES
+
+        output:
+        pops = fraction of the trajectories in each state, array (len(times), nb_struct)
+        fpt = first-passage time of each trajectory to one of the TARGETS (state ids)
+        """
+        init_pop = array(init_pop, dtype=float)
+        init_pop /= init_pop.sum()
+        times = array(times, dtype=float)
+        self.check_cost(times[-1])
+        if targets is not None:
+            target_mask = zeros(len(self), dtype=bool)
+            target_mask[list(targets)] = True
+            targets = target_mask
+        sizes = [min(self.chunk_size, self.nb_traj - start)
+                 for start in range(0, self.nb_traj, self.chunk_size)]
+        chunks = list(zip(sizes, SeedSequence(self.seed).spawn(len(sizes))))
+        chunk_args = (self.table, init_pop, times, targets, self.max_jumps, stop_at_targets)
+
+        if self.nb_proc > 1:
+            with Pool(self.nb_proc, initializer=init_worker, initargs=chunk_args) as pool:
+                results = pool.map(run_worker_chunk, chunks)
+        else:
+            init_worker(*chunk_args)
+            results = [run_worker_chunk(chunk) for chunk in chunks]
+
+        counts = sum(res[0] for res in results)
+        fpt = concatenate([res[1] for res in results])
+        nb_truncated = sum(res[2] for res in results)
+        if nb_truncated:
+            print(f"warning: {nb_truncated} of {self.nb_traj} trajectories stopped after "
+                  f"{self.max_jumps} jumps, frozen before t={times[-1]:.2e}: their populations "
+                  "and first-passage times are not converged", file=stderr)
+        self.nb_truncated += nb_truncated
+        return counts / self.nb_traj, fpt
+
+    def populations(self, init_pop, times):
+        "fraction of the trajectories in each state at each time, array (len(times), nb_struct)"
+        return self.simulate(init_pop, times)[0]
+
+    def stream(self, init_pop, times, chunk_size=None):
+        "iterate over (time, population), all the trajectories are run first"
+        yield from zip(times, self.populations(init_pop, times))
+
+    def first_passage(self, init_pop, targets, max_time):
+        "first-passage times to one of the TARGETS, inf if not reached before MAX_TIME"
+        return self.simulate(init_pop, [max_time], targets, stop_at_targets=True)[1]
+
+
+def first_passage_stats(fpt):
+    """summary of first-passage times: fraction of trajectories that reached the
+    targets, then the mean, median, 10% and 90% quantiles of the times of those
+    which did (nan if none)
+    """
+    reached = fpt[~isinf(fpt)]
+    stats = {"reached": len(reached) / max(1, len(fpt))}
+    for key, func in [("mean", np.mean), ("median", np.median),
+                      ("q10", lambda el: np.quantile(el, 0.1)),
+                      ("q90", lambda el: np.quantile(el, 0.9))]:
+        stats[key] = float(func(reached)) if len(reached) else float("nan")
+    return stats
@@ -0,0 +1,342 @@
+"""Command lines of the kinetics.
+
+rafft_kin builds the kinetic model of a RAFFT output (or folding graph) and
+generates a folding kinetic trajectory starting from the unfolded structure.
+"rafft kin" folds a sequence first and passes the trajectory in memory.
+
+Usage:
+rafft_kin rafft.out --plot
+rafft_kin --graph paths.npz --plot     # connectivity from rafft --graph
+rafft_kin rafft.out --backend gillespie --nb_traj 10000 --seed 1 -mt 14
+rafft_kin rafft.out --mode equilibrium
+rafft_kin rafft.out --mode mfpt --targets 59
+rafft_kin rafft.out --mode mfpt --targets 59 --backend gillespie --nb_traj 10000 -mt 14
+rafft kin -s GGGUUUGCGGUGUAAGUGCAGCCCGUCUUACACCGUGCGG -ms 20 --plot
+rafft_kin outputs/ "runs/*.out" --nb_proc 4 --table results.tsv
+cat *.out | rafft_kin - --batch
+
+With several inputs, a directory, a glob or --batch, each RAFFT output (a file,
+a file of a directory, or a record of a concatenated stream) is solved in a
+process pool and summarized in one line of a table.
+"""
+
+import argparse
+from glob import glob
+from multiprocessing import Pool
+from os import listdir
+from os.path import basename, isdir, isfile, join
+from sys import exit, stderr, stdout
+from time import time
+from numpy import array
+from rafft.rafft_kin import kinetics, plot_traj
+
+
+def kinetics_arguments(parser):
+    "options of the kinetics, shared by rafft_kin and rafft kin"
+    parser.add_argument('--out', '-o', help="output file")
+    parser.add_argument('--width', '-wi', help="figure width", type=int, default=7)
+    parser.add_argument('--height', '-he', help="figure height", type=int, default=5)
+    parser.add_argument('--n_steps', '-ns', help="integration steps", type=int, default=100)
+    parser.add_argument('--show_thres', '-st', help="threshold population to show", type=float, default=0.08)
+    parser.add_argument('--font_size', '-fs', help="font size for the colors", type=int, default=15)
+    parser.add_argument('--init_pop', '-ip', help="initialization of the population <POS>:<WEI>", nargs="*")
+    parser.add_argument('--uni', action="store_true", help="uniform initial distribution")
+    parser.add_argument('--other_rate', action="store_true", help="use the other rate")
+    parser.add_argument('--max_time', '-mt', help="max time (exp scale)", type=float, default=30)
+    parser.add_argument('--adaptive', '-ad', type=float, metavar="TOL",
+                        help="adaptive time grid: points added where the populations change by more than TOL\n"
+                        "(instead of --n_steps regular points)")
+    parser.add_argument('--plot', action="store_true", help="plot kinetics")
+    parser.add_argument('--pop_out', help="write the populations in this file as they are computed")
+    parser.add_argument('--backend', choices=["auto", "dense", "sparse", "gillespie"], default="auto",
+                        help="eigendecomposition (dense), Krylov propagation (sparse, default above 1000 structures\n"
+                        "or energies spanning more than 28 kcal/mol, where dense is inaccurate)\n"
+                        "or stochastic simulation (gillespie)")
+    parser.add_argument('--nb_traj', type=int, help="stochastic trajectories (gillespie)", default=1000)
+    parser.add_argument('--seed', type=int, help="seed of the stochastic trajectories")
+    parser.add_argument('--nb_proc', '-np', type=int, default=1,
+                        help="processes for the stochastic trajectories, or for the inputs in batch")
+    parser.add_argument('--lump', type=float, metavar="RATE",
+                        help="solve the kinetics of basins of structures exchanging faster than RATE (e.g. 0.5)")
+    parser.add_argument('--mode', choices=["trajectory", "equilibrium", "mfpt"], default="trajectory",
+                        help="trajectory, final populations only, or mean first-passage time from the initial\n"
+                        "population to the --targets (first-passage statistics with the gillespie backend)")
+    parser.add_argument('--targets', type=int, nargs="+", metavar="ID",
+                        help="target structures of --mode mfpt (default: lowest energy)")
+    parser.add_argument('--export_generator', help="save the sparse transition matrix in this .npz file")
+
+
+def parse_arguments(argv=None):
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(prog="rafft_kin", description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('rafft_out', nargs="*",
+                        help="rafft output (text or binary trajectory), several in batch (\"-\" for stdin)")
+    parser.add_argument('--graph', '-g', help="folding graph (rafft --graph) used as connectivity")
+    kinetics_arguments(parser)
+    parser.add_argument('--batch', action="store_true",
+                        help="one line of results per input: directories, globs and concatenated outputs\n"
+                        "(\">name\" lines name the records) are expanded")
+    parser.add_argument('--table', help="results table of the batch (default: standard output)")
+    parser.add_argument('--top', type=int, default=3, help="final populations in the batch table")
+    return parser.parse_args(argv)
+
+
+def parse_fold_arguments(argv=None):
+    """Parsing command line of rafft kin
+    """
+    parser = argparse.ArgumentParser(prog="rafft kin", description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sequence', '-s', help="sequence")
+    parser.add_argument('--seq_file', '-sf', help="sequence file")
+    parser.add_argument('--n_mode', '-n', help="Number of positional lags to search for stems", type=int, default=100)
+    parser.add_argument('--max_stack', '-ms', help="number of stored structures (default=1)", type=int, default=1)
+    parser.add_argument('--min_nrj', '-mn', help="minimum loop energy to be formed", type=float, default=0)
+    parser.add_argument('--min_hp', '-mh', help="minimum unpaired positions in hairpins", type=int, default=3)
+    parser.add_argument('--max_branch', help="maximum branches to explor", type=int, default=1000)
+    parser.add_argument('--temp', type=float, help="temperature", default=37.0)
+    parser.add_argument('-gc', '--gc_wei', type=float, help="GC weight", default=3.00)
+    parser.add_argument('-au', '--au_wei', type=float, help="AU weight", default=2.00)
+    parser.add_argument('-gu', '--gu_wei', type=float, help="GU weight", default=1.00)
+    parser.add_argument('--paths', action="store_true",
+                        help="connectivity from the folding paths of the search (as rafft --graph)")
+    kinetics_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def print_populations(equi_pop):
+    equi_pop.sort(key=lambda el: el[2])
+    for st, nrj, fp, si in equi_pop:
+        print("{} {:6.3f} {:5.1f} {:d}".format(st, fp, nrj, si))
+
+
+def run_mode(fast_paths, graph, init_population, args):
+    "final populations (equilibrium) or first-passage times (mfpt) without the trajectory"
+    from rafft.rafft_kin import kinetic_model, initial_population, equilibrium, mean_first_passage
+    struct_list, struct_map, transition_mat = kinetic_model(fast_paths, graph, sparse=True)
+    energies = [struct.energy for struct in struct_list]
+    init_pop = initial_population(len(struct_list), init_population)
+
+    if args.mode == "equilibrium":
+        pops = equilibrium(transition_mat, energies, init_pop)
+        print_populations([(struct.str_struct, struct.energy, pop, si)
+                           for si, (struct, pop) in enumerate(zip(struct_list, pops))])
+        return
+
+    # the lowest energy structure by default
+    targets = args.targets if args.targets is not None else [min(range(len(energies)), key=energies.__getitem__)]
+    print(" ".join(f"{struct_list[si].str_struct} {si}" for si in targets))
+    if args.backend == "gillespie":
+        from rafft.gillespie import StochasticPropagator, first_passage_stats
+        from rafft.rafft_kin import time_grid
+        propagator = StochasticPropagator(transition_mat, args.nb_traj, args.seed, args.nb_proc)
+        max_time = time_grid(args.max_time, args.n_steps)[-1]
+        stats = first_passage_stats(propagator.first_passage(init_pop, targets, max_time))
+        print(f"reached before {max_time:.3e}: {stats['reached']:.3f}")
+        print("mean {mean:.3e} median {median:.3e} q10 {q10:.3e} q90 {q90:.3e}".format(**stats))
+        print(f"truncated trajectories: {propagator.nb_truncated}")
+    else:
+        tau = mean_first_passage(transition_mat, targets)
+        init_pop = array(init_pop, dtype=float)
+        # from the initial population
+        mfpt = (init_pop * tau)[init_pop > 0].sum() / init_pop.sum()
+        print(f"mean first-passage time {mfpt:.3e}")
+
+
+def parse_init_pop(args):
+    if args.uni:
+        return "uniform"
+    init_population = None
+    if args.init_pop is not None:
+        init_population = []
+        for el in args.init_pop:
+            pos, wei = el.split(":")
+            init_population += [(int(pos), float(wei))]
+    return init_population
+
+
+def run(fast_paths, graph, args):
+    "kinetics of a landscape given as steps of structures and/or a FoldingGraph"
+    init_population = parse_init_pop(args)
+    if args.mode != "trajectory":
+        try:
+            run_mode(fast_paths, graph, init_population, args)
+        except ValueError as err:
+            # simulations refused by the gillespie backend
+            exit(f"error: {err}")
+        return
+
+    assert not (args.plot and args.pop_out), "error, --plot needs the trajectory in memory!"
+    pop_out = open(args.pop_out, "w") if args.pop_out is not None else None
+    stats = {}
+    try:
+        trajectory, times, struct_list, equi_pop = kinetics(fast_paths, args.max_time, args.n_steps,
+                                                            init_population, graph, pop_out,
+                                                            args.backend, args.export_generator,
+                                                            args.nb_traj, args.seed, args.nb_proc,
+                                                            args.lump, args.adaptive, stats)
+    except ValueError as err:
+        exit(f"error: {err}")
+    if pop_out is not None:
+        pop_out.close()
+    print_populations(equi_pop)
+    if args.backend == "gillespie":
+        print(f"truncated trajectories: {stats['nb_truncated']} of {args.nb_traj}", file=stderr)
+
+    if args.plot:
+        plot_traj(trajectory, struct_list, times, args.font_size, args.width, args.height,
+                  args.show_thres, args.out)
+
+
+def batch_inputs(paths):
+    "files of the batch: directories are listed and globs expanded, sorted"
+    for path in paths:
+        if path == "-" or isfile(path):
+            files = [path]
+        elif isdir(path):
+            files = sorted(join(path, el) for el in listdir(path)
+                           if not el.startswith(".") and isfile(join(path, el)))
+        else:
+            files = sorted(el for el in glob(path) if isfile(el))
+        if not files:
+            print(f"{path}: no such file", file=stderr)
+        yield from files
+
+
+def batch_records(paths):
+    """(name, fast paths) of each record of the inputs, named by their ">name"
+    line or by the file (name:k for the k-th unnamed record of a stream)"""
+    from rafft.rafft_io import read_records, is_traj_bin, TrajBin
+    for in_file in batch_inputs(paths):
+        base = "stdin" if in_file == "-" else basename(in_file)
+        try:
+            if in_file != "-" and is_traj_bin(in_file):
+                yield base, TrajBin(in_file).fast_paths()
+                continue
+            for rec_nb, (name, traj) in enumerate(read_records(in_file)):
+                if name is None:
+                    name = base if rec_nb == 0 else f"{base}:{rec_nb}"
+                yield name, traj.fast_paths()
+        except (ValueError, OSError) as err:
+            print(f"{in_file}: {err}", file=stderr)
+
+
+def init_batch(args):
+    "options shared by the workers of the batch"
+    global BATCH_ARGS
+    BATCH_ARGS = args
+
+
+def batch_kinetics(record):
+    """kinetics of one input of the batch
+
+    output: (name, values of the columns of TABLE_HEADER or None, error)
+    """
+    from rafft.rafft_kin import kinetic_model, initial_population, solve_kinetics
+    from rafft.rafft_kin import equilibrium, relaxation_times
+    args = BATCH_ARGS
+    name, fast_paths = record
+    start = time()
+    try:
+        sparse = None if args.backend == "auto" else args.backend in ["sparse", "gillespie"]
+        struct_list, struct_map, transition_mat = kinetic_model(fast_paths, None,
+                                                               True if args.lump is not None else sparse)
+        init_population = parse_init_pop(args)
+        init_pop = initial_population(len(struct_list), init_population)
+        # the stochastic trajectories of each input stay in its worker
+        stats = {}
+        trajectory, times, _, _ = solve_kinetics(struct_list, struct_map, transition_mat,
+                                                 args.max_time, args.n_steps, init_population, None,
+                                                 args.backend, args.nb_traj, args.seed, 1,
+                                                 args.lump, args.adaptive, stats)
+    except (AssertionError, IndexError, ValueError) as err:
+        return name, None, str(err) or type(err).__name__
+    energies = [struct.energy for struct in struct_list]
+    final = array(trajectory[-1], dtype=float)
+    equi = equilibrium(transition_mat, energies, init_pop)
+    dom, equi_dom = final.argmax(), equi.argmax()
+    top = final.argsort()[::-1][:args.top]
+    t50, t90 = relaxation_times(times, trajectory)
+    row = [len(struct_list[0].str_struct), len(struct_list), f"{t50:.3e}", f"{t90:.3e}",
+           struct_list[dom].str_struct, f"{final[dom]:.3f}", f"{energies[dom]:.1f}",
+           struct_list[equi_dom].str_struct, f"{equi[equi_dom]:.3f}", f"{energies[equi_dom]:.1f}",
+           ",".join(f"{si}:{final[si]:.3f}" for si in top), stats["nb_truncated"],
+           f"{time() - start:.2f}"]
+    return name, row, None
+
+
+TABLE_HEADER = ["name", "len_seq", "nb_struct", "t50", "t90", "dominant", "dominant_pop",
+                "dominant_nrj", "equi_dominant", "equi_pop", "equi_nrj", "top", "truncated", "time"]
+
+
+def run_batch(args):
+    """one tab-separated line per input: relaxation times (50% and 90% of the
+    relaxation), dominant final structure, dominant structure at equilibrium
+    and the TOP final populations (structure id:population), stochastic
+    trajectories stopped at the jump limit (gillespie)"""
+    assert not (args.plot or args.pop_out or args.export_generator), \
+        "error, --plot, --pop_out and --export_generator are not available in batch!"
+    assert args.mode == "trajectory", "error, --mode is not available in batch!"
+    out = open(args.table, "w") if args.table is not None else stdout
+    out.write("\t".join(TABLE_HEADER) + "\n")
+    records = batch_records(args.rafft_out)
+    nb_fail = 0
+    if args.nb_proc > 1:
+        pool = Pool(args.nb_proc, initializer=init_batch, initargs=(args,))
+        results = pool.imap(batch_kinetics, records)
+    else:
+        pool = None
+        init_batch(args)
+        results = map(batch_kinetics, records)
+    for name, row, err in results:
+        if row is None:
+            nb_fail += 1
+            print(f"{name}: {err}", file=stderr)
+            continue
+        out.write("\t".join(map(str, [name] + row)) + "\n")
+        out.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if out is not stdout:
+        out.close()
+    if nb_fail:
+        print(f"{nb_fail} input(s) failed", file=stderr)
+
+
+def main(argv=None):
+    "rafft_kin"
+    from rafft.rafft_io import read_trajectory
+    args = parse_arguments(argv)
+    if args.batch or len(args.rafft_out) > 1 or (args.rafft_out and not isfile(args.rafft_out[0])):
+        assert args.graph is None, "error, --graph is not available in batch!"
+        run_batch(args)
+        return
+    assert args.rafft_out or args.graph is not None, "error, no rafft output or graph!"
+    graph, fast_paths = None, None
+    if args.graph is not None:
+        from rafft.path_graph import read_graph
+        graph = read_graph(args.graph)
+    if args.rafft_out:
+        fast_paths = read_trajectory(args.rafft_out[0]).fast_paths()
+    run(fast_paths, graph, args)
+
+
+def fold_main(argv=None):
+    "rafft kin: the trajectory of the fold is used in memory"
+    from rafft.rafft import fold
+    args = parse_fold_arguments(argv)
+    assert args.sequence is not None or args.seq_file is not None, "error, the sequence is missing!"
+    if args.sequence is not None:
+        sequence = args.sequence
+    else:
+        sequence = "".join([l.strip() for l in open(args.seq_file) if not l.startswith(">")]).replace("T", "U")
+    graph = None
+    if args.paths:
+        from rafft.path_graph import FoldingGraph
+        graph = FoldingGraph(sequence)
+    _, fast_paths = fold(sequence, args.n_mode, args.max_stack, args.max_branch, args.min_hp,
+                         args.min_nrj, True, args.temp, args.gc_wei, args.au_wei, args.gu_wei,
+                         graph=graph)
+    run(fast_paths, graph, args)
@@ -0,0 +1,164 @@
+"""Scan all the single point mutants of a sequence.
+
+The wild-type sequence is encoded and folded once. A point mutation only
+changes one column of the encoded strands, so the correlation of each mutant is
+obtained from the wild-type one with a rank-one update. The candidate stems of
+the unpaired segments that do not contain the mutated position are reused from
+the wild-type fold, and so are the window slides of the other segments at the
+lags which do not align the mutated position (the slides are most of the
+search).
+"""
+
+from bisect import bisect_left
+from multiprocessing import Pool
+from numpy import flip
+from RNA import bp_distance
+from rafft.rafft import bfs_pairs, lag_stems
+from rafft.utils import seq_conv, prep_sequence, Glob_parms, Node, Structure
+from rafft.correlation import lags_from_cor, pair_weights
+
+NUCS = "ACGU"
+
+
+class MutantCache(dict):
+    "segment cache of a mutant falling back on the wild-type cache"
+
+    def __init__(self, wt_cache, mut_pos):
+        super().__init__()
+        self.wt_cache, self.mut_pos = wt_cache, mut_pos
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        # segments are sorted positions, reuse them if the mutation is outside
+        ip = bisect_left(key, self.mut_pos)
+        if ip < len(key) and key[ip] == self.mut_pos:
+            return default
+        return self.wt_cache.get(key, default)
+
+
+class MutantSlides(dict):
+    "window slides of a mutant falling back on the wild-type slides"
+
+    def __init__(self, wt_slides, mut_pos):
+        super().__init__()
+        self.wt_slides, self.mut_pos = wt_slides, mut_pos
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        seg, lag = key
+        ip = bisect_left(seg, self.mut_pos)
+        # the window at LAG only reads the positions lag-len+1..lag of the segment
+        if ip < len(seg) and seg[ip] == self.mut_pos and lag - len(seg) < ip <= lag:
+            return default
+        return self.wt_slides.get(key, default)
+
+
+def cor_update(cor, eseq, cseq, pos, ecol, ccol):
+    """Update the raw correlation when the column at POS is replaced. Each lag k
+    sums e_i.c_j over i+j=k, so only terms with i=POS or j=POS change.
+    """
+    len_seq = eseq.shape[1]
+    # unflipped complementary strand
+    fcseq = flip(cseq, axis=1)
+    d_e = ecol - eseq[:, pos]
+    d_c = ccol - fcseq[:, pos]
+    new_cor = cor.copy()
+    new_cor[pos:pos+len_seq] += d_e @ fcseq + d_c @ eseq
+    new_cor[2*pos] += d_e @ d_c
+    return new_cor
+
+
+def list_mutants(sequence):
+    "all single point mutants (position, wild-type, mutant)"
+    return [(pos, wt, mut) for pos, wt in enumerate(sequence)
+            for mut in NUCS if mut != wt]
+
+
+def init_worker(wt_data):
+    "share the wild-type data with the workers"
+    global WT_DATA
+    WT_DATA = wt_data
+
+
+def fold_mutant(mutant):
+    "fold one mutant from the wild-type encoding and correlations"
+    pos, wt, mut = mutant
+    sequence, fold_args, wt_cor, eseq, cseq, wt_cache, wt_slides = WT_DATA
+    nb_mode, max_stack, max_branch, min_hp, min_nrj, temp, gc_wei, au_wei, gu_wei = fold_args
+    len_seq = len(sequence)
+    mut_seq = sequence[:pos] + mut + sequence[pos+1:]
+
+    glob_parms = Glob_parms(mut_seq, nb_mode, max_stack, max_branch, min_hp,
+                            min_nrj, False, temp, gc_wei, au_wei, gu_wei)
+    glob_parms.cor_cache = MutantCache(wt_cache, pos)
+    glob_parms.slide_cache = MutantSlides(wt_slides, pos)
+
+    # the mutation changes a single column of both strands
+    ecol, ccol = prep_sequence(mut, gc_wei, au_wei, gu_wei)
+    ecol, ccol = ecol[:, 0], ccol[:, 0]
+    mut_cor = cor_update(wt_cor, eseq, cseq, pos, ecol, ccol)
+    mut_eseq, mut_cseq = eseq.copy(), cseq.copy()
+    mut_eseq[:, pos] = ecol
+    mut_cseq[:, len_seq-pos-1] = ccol
+
+    pos_list = list(range(len_seq))
+    init_node = Node(mut_eseq, mut_cseq, pos_list)
+    glob_parms.cor_cache[tuple(pos_list)] = lag_stems(init_node, lags_from_cor(mut_cor, nb_mode),
+                                                      glob_parms)
+    unfold_struct = Structure(node_list=[init_node], pair_list=[])
+    unfold_struct.str_struct = "."*len_seq
+
+    structures, _ = bfs_pairs([unfold_struct], glob_parms, step=0,
+                              glob_traj=[], seen=set())
+    best = structures[0]
+    return pos, wt, mut, best.str_struct, best.energy
+
+
+def scan_mutants(sequence, nb_mode=100, max_stack=1, max_branch=100, min_hp=3,
+                 min_nrj=0.0, temp=37.0, gc_wei=3.0, au_wei=2.0, gu_wei=1.0,
+                 nb_proc=1, mutants=None):
+    """Fold all single point mutants of a sequence (or the given list of
+    (position, wild-type, mutant)).
+
+    output:
+    wt_struct, wt_nrj = best wild-type structure and its energy
+    results = list of (position, wild-type, mutant, structure, energy,
+              energy change, bp distance to the wild-type)
+    """
+    fold_args = (nb_mode, max_stack, max_branch, min_hp, min_nrj, temp,
+                 gc_wei, au_wei, gu_wei)
+    len_seq = len(sequence)
+    glob_parms = Glob_parms(sequence, nb_mode, max_stack, max_branch, min_hp,
+                            min_nrj, False, temp, gc_wei, au_wei, gu_wei)
+    glob_parms.slide_cache = {}
+
+    # fold the wild-type once, its segment caches are shared with the mutants
+    eseq, cseq = prep_sequence(sequence, gc_wei, au_wei, gu_wei)
+    wt_cor = seq_conv(eseq, cseq, weights=pair_weights(gc_wei, au_wei, gu_wei))
+    pos_list = list(range(len_seq))
+    unfold_struct = Structure(node_list=[Node(eseq, cseq, pos_list)], pair_list=[])
+    unfold_struct.str_struct = "."*len_seq
+    structures, _ = bfs_pairs([unfold_struct], glob_parms, step=0,
+                              glob_traj=[], seen=set())
+    wt_struct, wt_nrj = structures[0].str_struct, structures[0].energy
+
+    if mutants is None:
+        mutants = list_mutants(sequence)
+    wt_data = (sequence, fold_args, wt_cor, eseq, cseq, glob_parms.cor_cache,
+               glob_parms.slide_cache)
+
+    if nb_proc > 1:
+        with Pool(nb_proc, initializer=init_worker, initargs=(wt_data,)) as pool:
+            mut_folds = pool.map(fold_mutant, mutants,
+                                 chunksize=max(1, len(mutants) // (4 * nb_proc)))
+    else:
+        init_worker(wt_data)
+        mut_folds = [fold_mutant(mutant) for mutant in mutants]
+
+    results = []
+    for pos, wt, mut, struct, nrj in mut_folds:
+        results += [(pos, wt, mut, struct, nrj, nrj - wt_nrj,
+                     bp_distance(wt_struct, struct))]
+    return wt_struct, wt_nrj, results
@@ -0,0 +1,160 @@
+"""Folding paths found by the search.
+
+A FoldingGraph is filled during fold(graph=...): its nodes are the structures
+saved at each step, with integer ids given in order of appearance (0 is the
+unfolded structure), and its edges link a structure to each structure formed
+from it by adding stems. Structures are found by fingerprint in a dict, the
+adjacency is stored in arrays and turned into CSR arrays for the queries.
+
+Graphs are exported as an edge list (text) or a compressed .npz file, and read
+back with read_graph. rafft_kin uses the edges as the connectivity of its
+transition matrix.
+"""
+
+from array import array
+from numpy import frombuffer, argsort, bincount, cumsum, concatenate, savez_compressed, load
+from numpy import zeros, int32, float64
+from rafft.utils import Structure
+
+
+def to_numpy(buf, dtype):
+    "copy of an array.array (a view would prevent it from growing)"
+    return frombuffer(buf, dtype=dtype).copy() if len(buf) else zeros(0, dtype=dtype)
+
+
+class FoldingGraph:
+    "DAG of the folding paths"
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.ids = {}
+        self.structures = []
+        self.energies, self.steps = array("d"), array("i")
+        self.src, self.dst = array("i"), array("i")
+        self.edge_set = set()
+        self.csr = None
+
+    def __len__(self):
+        return len(self.structures)
+
+    @property
+    def nb_edges(self):
+        return len(self.src)
+
+    def node_id(self, str_struct):
+        "id of a structure, None if it is not in the graph"
+        return self.ids.get(str_struct)
+
+    def add_node(self, str_struct, energy, step):
+        "id of a structure, added if needed"
+        node = self.ids.get(str_struct)
+        if node is None:
+            node = self.ids[str_struct] = len(self.structures)
+            self.structures.append(str_struct)
+            self.energies.append(energy)
+            self.steps.append(step)
+            self.csr = None
+        return node
+
+    def add_edge(self, parent, child):
+        if (parent, child) not in self.edge_set:
+            self.edge_set.add((parent, child))
+            self.src.append(parent)
+            self.dst.append(child)
+            self.csr = None
+
+    def edges(self):
+        "arrays of the parents and children of all the edges"
+        return to_numpy(self.src, int32), to_numpy(self.dst, int32)
+
+    def adjacency(self):
+        """CSR arrays of the children and of the parents:
+        children of n = child_ids[child_ptr[n]:child_ptr[n+1]]
+        """
+        if self.csr is None:
+            src, dst = self.edges()
+            nb_node = len(self)
+            self.csr = []
+            for key, val in [(src, dst), (dst, src)]:
+                order = argsort(key, kind="stable")
+                ptr = concatenate(([0], cumsum(bincount(key, minlength=nb_node))))
+                self.csr += [ptr, val[order]]
+        return self.csr
+
+    def children(self, node):
+        child_ptr, child_ids, _, _ = self.adjacency()
+        return child_ids[child_ptr[node]:child_ptr[node+1]]
+
+    def parents(self, node):
+        _, _, parent_ptr, parent_ids = self.adjacency()
+        return parent_ids[parent_ptr[node]:parent_ptr[node+1]]
+
+    def fast_paths(self):
+        "list of steps of Structure, each structure in the step it appeared"
+        paths = [[] for _ in range(max(self.steps) + 1 if len(self) else 0)]
+        for str_struct, energy, step in zip(self.structures, self.energies, self.steps):
+            struct = Structure([], [])
+            struct.str_struct, struct.energy = str_struct, energy
+            paths[step] += [struct]
+        return paths
+
+    def state(self):
+        "plain python objects (for the checkpoints)"
+        return {"structures": self.structures, "energies": list(self.energies),
+                "steps": list(self.steps), "src": list(self.src), "dst": list(self.dst)}
+
+    def load_state(self, state):
+        for str_struct, energy, step in zip(state["structures"], state["energies"], state["steps"]):
+            self.add_node(str_struct, energy, step)
+        for parent, child in zip(state["src"], state["dst"]):
+            self.add_edge(parent, child)
+
+    def write(self, out_file):
+        """Save the graph, in a .npz file (packed structures) or as a text edge
+        list: the sequence, the nodes (id structure energy step) then the edges
+        (parent child)
+        """
+        src, dst = self.edges()
+        if out_file.endswith(".npz"):
+            from rafft.rafft_io import pack_structures
+            packed = pack_structures(self.structures) if len(self) else zeros((0, 0))
+            savez_compressed(out_file, sequence=self.sequence, packed=packed,
+                             energies=to_numpy(self.energies, float64),
+                             steps=to_numpy(self.steps, int32), src=src, dst=dst)
+        else:
+            with open(out_file, "w") as out:
+                lines = [self.sequence, "# nodes: id structure energy step"]
+                lines += [f"{node} {str_struct} {energy:.2f} {step}" for node, (str_struct, energy, step)
+                          in enumerate(zip(self.structures, self.energies, self.steps))]
+                lines += ["# edges: parent child"]
+                lines += [f"{parent} {child}" for parent, child in zip(src.tolist(), dst.tolist())]
+                out.write("\n".join(lines) + "\n")
+
+
+def read_graph(in_file):
+    "FoldingGraph from a file written by FoldingGraph.write"
+    if in_file.endswith(".npz"):
+        from rafft.rafft_io import unpack_structures
+        data = load(in_file)
+        sequence = str(data["sequence"])
+        graph = FoldingGraph(sequence)
+        structures = unpack_structures(data["packed"], len(sequence)) if len(data["energies"]) else []
+        for str_struct, energy, step in zip(structures, data["energies"].tolist(), data["steps"].tolist()):
+            graph.add_node(str_struct, energy, step)
+        for parent, child in zip(data["src"].tolist(), data["dst"].tolist()):
+            graph.add_edge(parent, child)
+        return graph
+
+    with open(in_file) as inp:
+        graph = FoldingGraph(inp.readline().strip())
+        section = None
+        for l in inp:
+            if l.startswith("#"):
+                section = l.split()[1]
+            elif section == "nodes:":
+                _, str_struct, energy, step = l.split()
+                graph.add_node(str_struct, float(energy), int(step))
+            elif section == "edges:":
+                parent, child = l.split()
+                graph.add_edge(int(parent), int(child))
+    return graph
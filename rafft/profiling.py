@@ -0,0 +1,92 @@
+"""Instrumentation of the folding engine.
+
+A Profiler attached to a fold (fold(profile=...)) records the wall time spent
+in each stage, the number of calls, counters (segments expanded, candidate
+stems, combinations, cache hits, ...) for every step and the peak memory of the
+process. Stage times are exclusive: the time of a stage does not include the
+stages called from it. Without profiler, the engine only pays a test per call.
+"""
+
+import json
+from resource import getrusage, RUSAGE_SELF
+from sys import platform
+from time import perf_counter
+
+STAGES = ["correlation", "window_slide", "dot_bracket", "vienna_eval",
+          "combinations", "segments"]
+
+
+class Profiler:
+    "per stage timers and counters of a fold"
+
+    def __init__(self):
+        self.times, self.calls, self.counters = {}, {}, {}
+        self.steps = []
+        self.stack = []
+        self.start, self.end = perf_counter(), None
+
+    def push(self, stage):
+        "enter a stage, the time of the current stage is paused"
+        now = perf_counter()
+        if self.stack:
+            parent = self.stack[-1]
+            self.times[parent[0]] = self.times.get(parent[0], 0.0) + now - parent[1]
+        self.stack += [[stage, now]]
+
+    def pop(self):
+        "leave the current stage and resume its parent"
+        now = perf_counter()
+        stage, start = self.stack.pop()
+        self.times[stage] = self.times.get(stage, 0.0) + now - start
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        if self.stack:
+            self.stack[-1][1] = now
+
+    def count(self, name, nb=1):
+        self.counters[name] = self.counters.get(name, 0) + nb
+
+    def new_step(self):
+        "counters of a new search step"
+        self.steps += [{}]
+
+    def count_step(self, name, nb=1):
+        self.steps[-1][name] = self.steps[-1].get(name, 0) + nb
+
+    def stop(self):
+        self.end = perf_counter()
+
+    def report(self):
+        "all the measures in a dict"
+        total = (self.end or perf_counter()) - self.start
+        stages = {stage: {"time": self.times.get(stage, 0.0), "calls": self.calls.get(stage, 0)}
+                  for stage in STAGES + sorted(set(self.times) - set(STAGES))}
+        stages["other"] = {"time": max(0.0, total - sum(self.times.values())), "calls": 0}
+        hits, misses = self.counters.get("cor_cache_hit", 0), self.counters.get("cor_cache_miss", 0)
+        # ru_maxrss is in kB on Linux and in bytes on macOS
+        peak = getrusage(RUSAGE_SELF).ru_maxrss / (2**20 if platform == "darwin" else 2**10)
+        return {"total_time": total, "stages": stages, "counters": self.counters,
+                "cor_cache_hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0,
+                "steps": self.steps, "peak_memory_mb": peak}
+
+    def text(self):
+        "human readable report"
+        rep = self.report()
+        lines = [f"total {rep['total_time']:.4f} s, peak memory {rep['peak_memory_mb']:.1f} MB"]
+        lines += [f"{'stage':14s} {'time (s)':>10s} {'%':>6s} {'calls':>10s}"]
+        for stage, val in rep["stages"].items():
+            perc = 100.0 * val["time"] / rep["total_time"] if rep["total_time"] > 0 else 0.0
+            lines += [f"{stage:14s} {val['time']:10.4f} {perc:6.1f} {val['calls']:10d}"]
+        lines += [f"correlation cache hit rate {rep['cor_cache_hit_rate']:.3f}"]
+        for name, val in sorted(rep["counters"].items()):
+            lines += [f"{name} {val}"]
+        names = sorted(set(name for step in rep["steps"] for name in step))
+        lines += ["step " + " ".join(names)]
+        for si, step in enumerate(rep["steps"]):
+            lines += [f"{si:4d} " + " ".join(str(step.get(name, 0)) for name in names)]
+        return "\n".join(lines)
+
+    def json(self, **extra):
+        "one line JSON report, EXTRA fields identify the fold in a batch"
+        rep = self.report()
+        rep.update(extra)
+        return json.dumps(rep)
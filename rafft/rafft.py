@@ -25,12 +25,19 @@ The algorithm has two critical parameters:
 """
 
 from numpy import sum as npsum
-from rafft.utils import auto_cor, dot_bracket
+from rafft.utils import seq_conv, dot_bracket
+from rafft.correlation import lags_from_cor, pair_weights
 from rafft.utils import prep_sequence
 from rafft.utils import get_inner_loop, get_outer_loop, eval_one_struct
-from rafft.utils import merge_pair_list
+from rafft.utils import merge_pair_list, boltzmann_choice
 from rafft.utils import Glob_parms, Node, Structure
+from rafft.checkpoint import save_checkpoint, load_checkpoint
+from rafft.cache import get_cache, result_key, to_struct
+from rafft.profiling import Profiler
+from os.path import exists
+from sys import stderr
 from itertools import product
+from numpy import float32 as float32_t
 
 
 def window_slide(seq, cseq, pos, pos_list, min_hp):
@@ -83,26 +90,65 @@ def window_slide(seq, cseq, pos, pos_list, min_hp):
     return max_nb, max_i, max_j, max_score
 
 
-def find_best_consecutives(cor_l, upair, cur_str, glob_parms):
-    # find largest bp region
-    best_sol = []
-    max_bp, max_i, max_j, max_s, tmp_nrj = 0, 0, 0, 0, glob_parms.min_nrj
-    best_nrj = glob_parms.min_nrj
-
-    for pos, c in cor_l[::-1][:glob_parms.nb_mode]:
-        mx_i, mip, mjp, ms = window_slide(upair.forward, upair.backward, pos,
-                                          upair.pos_list, glob_parms.min_hp)
-
+def lag_stems(upair, lags, glob_parms):
+    """Stems found by sliding a window at each correlation lag of a segment, as
+    (nb of BPs, score, i, j, pairs). They only depend on the segment.
+    """
+    prof = glob_parms.profiler
+    slides = glob_parms.slide_cache
+    if slides is not None:
+        key = tuple(upair.pos_list)
+    stems = []
+    for pos, c in lags:
+        slide = None if slides is None else slides.get((key, pos))
+        if slide is None:
+            if prof is not None:
+                prof.push("window_slide")
+            slide = window_slide(upair.forward, upair.backward, pos,
+                                 upair.pos_list, glob_parms.min_hp)
+            if prof is not None:
+                prof.pop()
+            if slides is not None:
+                slides[(key, pos)] = slide
+
+        mx_i, mip, mjp, ms = slide
         if mx_i > 0:
-            tmp_pair = [(upair.pos_list[mip-i], upair.pos_list[mjp+i]) for i in range(mx_i)]
-            tmp_nrj = eval_one_struct(cur_str.pair_list+tmp_pair, glob_parms) - cur_str.energy
-        else:
-            tmp_nrj = glob_parms.min_nrj
+            pairs = tuple((upair.pos_list[mip-i], upair.pos_list[mjp+i]) for i in range(mx_i))
+            stems += [(mx_i, ms, mip, mjp, pairs)]
+    return stems
+
 
-        if tmp_nrj < glob_parms.min_nrj:
-            max_bp, max_s, max_i, max_j = mx_i, ms, mip, mjp
-            best_tmp = tmp_pair
-            best_nrj = tmp_nrj
+def segment_stems(upair, glob_parms):
+    """Candidate stems of an unpaired segment. The encoding of a segment only
+    depends on its positions, so the stems are cached by positions.
+    """
+    prof = glob_parms.profiler
+    key = tuple(upair.pos_list)
+    stems = glob_parms.cor_cache.get(key)
+    if stems is None:
+        if prof is not None:
+            prof.count("cor_cache_miss")
+            prof.push("correlation")
+        cor = seq_conv(upair.forward, upair.backward, glob_parms.cor_dtype,
+                       pair_weights(glob_parms.gc_wei, glob_parms.au_wei, glob_parms.gu_wei,
+                                    glob_parms.cor_dtype))
+        lags = lags_from_cor(cor, glob_parms.nb_mode)
+        if prof is not None:
+            prof.pop()
+        stems = lag_stems(upair, lags, glob_parms)
+        glob_parms.cor_cache[key] = stems
+    elif prof is not None:
+        prof.count("cor_cache_hit")
+    return stems
+
+
+def find_best_consecutives(stems, cur_str, glob_parms):
+    # find the stems improving the energy
+    best_sol = []
+    for max_bp, max_s, max_i, max_j, pairs in stems:
+        best_tmp = list(pairs)
+        best_nrj = eval_one_struct(cur_str.pair_list+best_tmp, glob_parms) - cur_str.energy
+        if best_nrj < glob_parms.min_nrj:
             best_sol += [(max_bp, max_s, max_i, max_j, best_nrj, best_tmp)]
 
     best_sol.sort(key=lambda el: el[4])
@@ -114,10 +160,9 @@ def create_childs(upair, cur_str, glob_parms):
     """
 
     len_seq = upair.forward.shape[1]
-    cor_l = auto_cor(upair.forward, upair.backward)
-    cor_l.sort(key=lambda el: el[1])
+    stems = segment_stems(upair, glob_parms)
 
-    best_solutions = find_best_consecutives(cor_l, upair, cur_str, glob_parms)
+    best_solutions = find_best_consecutives(stems, cur_str, glob_parms)
 
     cur_list_sol = []
     for solution in best_solutions:
@@ -156,26 +201,53 @@ def create_childs(upair, cur_str, glob_parms):
 def bfs_pairs(glob_tree, glob_parms, step=0, glob_traj=[], seen=set()):
     """Bread-first procedure to create helices.
     """
+    if glob_parms.checkpoint is not None and step % glob_parms.checkpoint_every == 0:
+        save_checkpoint(glob_parms.checkpoint, glob_tree, glob_traj, seen, step, glob_parms)
+
     tmp_glob_tree = []
     new_glob_tree = []
     glob_traj += [glob_tree]
+    prof = glob_parms.profiler
+    graph = glob_parms.graph
+    if graph is not None:
+        for struct in glob_tree:
+            graph.add_node(struct.str_struct, struct.energy, step)
+        # (parent, child) formed at this step
+        links = []
+    if prof is not None:
+        prof.new_step()
+        prof.count_step("structures", len(glob_tree))
 
     # split current nodes
     for struct in glob_tree:
         tmp_tree = []
         for un_paired in struct.node_list:
             # create possible helices from the unpaired region
+            if prof is not None:
+                prof.push("segments")
             cur_list = create_childs(un_paired, struct, glob_parms)
+            if prof is not None:
+                prof.pop()
+                prof.count_step("segments")
+                prof.count_step("candidates", len(cur_list))
+
+            if glob_parms.rng is not None and len(cur_list) > 1:
+                # sampling mode: one stem per segment, drawn by energy
+                pick = boltzmann_choice(glob_parms.rng, [el[3] for el in cur_list],
+                                        glob_parms.sample_kt)[0]
+                cur_list = [cur_list[pick]]
 
             if len(cur_list) > 0:
                 tmp_tree += [cur_list]
 
         if len(tmp_tree) > 0:
-            tmp_glob_tree += [tmp_tree]
+            tmp_glob_tree += [(struct, tmp_tree)]
 
     # Combine stems formed in independent sub segments
+    if prof is not None:
+        prof.push("combinations")
     nb_branch = 0
-    for helices in tmp_glob_tree:
+    for parent, helices in tmp_glob_tree:
         # a comp is a combination of helices
         for helix in product(*helices):
             tmp_tree = Structure(node_list=[], pair_list=[])
@@ -191,24 +263,49 @@ def bfs_pairs(glob_tree, glob_parms, step=0, glob_traj=[], seen=set()):
 
             new_nrj = eval_one_struct(tmp_tree.pair_list, glob_parms)
             tmp_tree.energy = new_nrj
+            if prof is not None:
+                prof.push("dot_bracket")
             tmp_str = dot_bracket(tmp_tree.pair_list, glob_parms.len_seq)
+            if prof is not None:
+                prof.pop()
+                prof.count_step("combinations")
+            if graph is not None:
+                links += [(parent.str_struct, tmp_str)]
 
             if tmp_str not in seen:
                 tmp_tree.str_struct = tmp_str
                 new_glob_tree += [tmp_tree]
                 nb_branch += 1
                 seen.add(tmp_str)
+                if prof is not None:
+                    prof.count_step("new_structures")
 
             if nb_branch >= glob_parms.max_branch:
                 break
+    if prof is not None:
+        prof.pop()
 
     # sort by energy
     new_glob_tree += glob_tree
+    if glob_parms.rng is not None:
+        # sampling mode: draw the saved structures by energy
+        picks = boltzmann_choice(glob_parms.rng, [st.energy for st in new_glob_tree],
+                                 glob_parms.sample_kt, glob_parms.max_stack)
+        new_glob_tree = [new_glob_tree[si] for si in sorted(picks)]
     new_glob_tree.sort(key=lambda el: el.energy)
 
     # Save the best trajectories among all the combinations of helices
     new_glob_tree = new_glob_tree[:glob_parms.max_stack]
 
+    if graph is not None:
+        # link the surviving structures (or those saved before) to their parents
+        for struct in new_glob_tree:
+            graph.add_node(struct.str_struct, struct.energy, step+1)
+        for parent, child in links:
+            child_id = graph.node_id(child)
+            if child_id is not None:
+                graph.add_edge(graph.node_id(parent), child_id)
+
     # test if the same structures are found
     if [st.str_struct for st in glob_tree] == [st.str_struct for st in new_glob_tree]:
         return glob_tree, glob_traj
@@ -218,20 +315,78 @@ def bfs_pairs(glob_tree, glob_parms, step=0, glob_traj=[], seen=set()):
 
 def fold(sequence, nb_mode=100, max_stack=1, max_branch=100, min_hp=3,
          min_nrj=0.0, traj=False, temp=37.0, gc_wei=3.0, au_wei=2.0,
-         gu_wei=1.0):
-    "fold a given sequence"
-    glob_parms = Glob_parms(sequence, nb_mode, max_stack, max_branch, min_hp,
-                            min_nrj, traj, temp, gc_wei, au_wei, gu_wei)
-    
-    pos_list = list(range(glob_parms.len_seq))
-
-    eseq, cseq = prep_sequence(sequence, gc_wei, au_wei, gu_wei)
-    init_node = Node(eseq, cseq, pos_list)
-    unfold_struct = Structure(node_list=[init_node], pair_list=[])
-    unfold_struct.str_struct = "."*glob_parms.len_seq
-
-    structures, trajectory = bfs_pairs([unfold_struct], glob_parms,
-                                       step=0, glob_traj=[], seen=set())
+         gu_wei=1.0, checkpoint=None, checkpoint_every=1, resume=False,
+         cache=None, float32=False, profile=False, graph=None):
+    """fold a given sequence
+
+    If a checkpoint file is given, the search state is saved every
+    CHECKPOINT_EVERY steps. With RESUME, the fold restarts from this file when
+    it exists.
+
+    CACHE is a ResultCache or the path of a cache file (default: the
+    RAFFT_CACHE environment variable), results are read from it when available.
+
+    With FLOAT32, the correlations are computed in single precision.
+
+    PROFILE is a rafft.profiling.Profiler filled during the fold, or True to
+    print a report on stderr.
+
+    GRAPH is a rafft.path_graph.FoldingGraph filled with the folding paths
+    (the result cache is not used then).
+    """
+    if profile is True:
+        prof = Profiler()
+    else:
+        prof = profile if profile else None
+
+    # single precision results are not cached
+    cache = get_cache(cache) if not float32 and graph is None else None
+    cached = None
+    if cache is not None:
+        key = result_key(sequence, nb_mode, max_stack, max_branch, min_hp,
+                         min_nrj, temp, gc_wei, au_wei, gu_wei)
+        cached = cache.get(key, traj)
+        if prof is not None:
+            prof.count("result_cache_hit" if cached is not None else "result_cache_miss")
+
+    if cached is not None:
+        structures = [to_struct(*el) for el in cached[0]]
+        if traj:
+            trajectory = [[to_struct(*el) for el in fold_step] for fold_step in cached[1]]
+    else:
+        glob_parms = Glob_parms(sequence, nb_mode, max_stack, max_branch, min_hp,
+                                min_nrj, traj, temp, gc_wei, au_wei, gu_wei)
+        glob_parms.checkpoint, glob_parms.checkpoint_every = checkpoint, checkpoint_every
+        if float32:
+            glob_parms.cor_dtype = float32_t
+        glob_parms.profiler = prof
+        glob_parms.graph = graph
+
+        pos_list = list(range(glob_parms.len_seq))
+
+        eseq, cseq = prep_sequence(sequence, gc_wei, au_wei, gu_wei)
+
+        if resume and checkpoint is not None and exists(checkpoint):
+            glob_tree, glob_traj, seen, step = load_checkpoint(checkpoint, glob_parms,
+                                                               eseq, cseq)
+        else:
+            init_node = Node(eseq, cseq, pos_list)
+            unfold_struct = Structure(node_list=[init_node], pair_list=[])
+            unfold_struct.str_struct = "."*glob_parms.len_seq
+            glob_tree, glob_traj, seen, step = [unfold_struct], [], set(), 0
+
+        structures, trajectory = bfs_pairs(glob_tree, glob_parms, step=step,
+                                           glob_traj=glob_traj, seen=seen)
+
+        if cache is not None:
+            cache.put(key, [(st.str_struct, st.energy) for st in structures],
+                      [[(st.str_struct, st.energy) for st in fold_step]
+                       for fold_step in trajectory] if traj else None)
+
+    if prof is not None:
+        prof.stop()
+        if profile is True:
+            print(prof.text(), file=stderr)
 
     if traj:
         return structures, trajectory
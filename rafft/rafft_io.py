@@ -0,0 +1,464 @@
+"""Reading and writing RAFFT trajectories.
+
+The text output of rafft is the sequence, then for each step a "# ---i---" line
+followed by "structure energy" lines (an output without trajectory has no step
+lines, it is read as a single step). It is read either as a stream of steps
+(stream_rafft_output) or all at once into columns (load_rafft_output): the
+energies, the step of each structure and a packed structure matrix. Both read
+the file by large chunks and check its format. Concatenated outputs of several
+sequences (each one optionally preceded by a ">name" line) are read record by
+record with read_records.
+
+Trajectories can also be stored in a compact binary format:
+
+  header      magic, version, sequence length, number of steps and structures
+  sequence    ascii
+  structures  dot-brackets packed on 2 bits per position ('.', '(', ')'),
+              one row of ceil(len/4) bytes per structure
+  energies    float32, one per structure
+  parents     int32, index (in the previous step) of the lowest energy
+              structure whose pairs are all kept, -1 if none
+  offsets     uint64, index of the first structure of each step (+ the total)
+
+Sections are 8 bytes aligned. The reader memory-maps the file, so any step or
+structure is accessed without loading the rest.
+"""
+
+import struct
+from warnings import catch_warnings, simplefilter
+from numpy import memmap, zeros, full, array, arange, searchsorted, concatenate
+from numpy import repeat, diff, frombuffer, fromstring, cumsum, bincount, flatnonzero
+from numpy import minimum, maximum
+from numpy import uint8, int8, int32, int64, uint64, float32, float64
+from rafft.utils import struct_matrix, pair_arrays, pair_matrix, subset_links, Structure
+
+MAGIC = b"RAFFTTRJ"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQ")
+CHUNK_SIZE = 1 << 22
+NEWLINE, HASH, SPACE, TAB = (ord(char) for char in "\n# \t")
+
+# 2 bits codes of the dot-bracket characters
+PACK_LUT = zeros(256, dtype=uint8) + 3
+for code, char in enumerate(".()"):
+    PACK_LUT[ord(char)] = code
+CODE_CHARS = frombuffer(b".()?", dtype=uint8)
+UNPACK_LUT = array([[ord(".()?"[(byte >> (2*k)) & 3]) for k in range(4)]
+                    for byte in range(256)], dtype=uint8)
+
+
+def align(pos):
+    return (pos + 7) // 8 * 8
+
+
+def row_bytes(len_seq):
+    return (len_seq + 3) // 4
+
+
+def pack_codes(codes):
+    "pack a (nb_struct x len) matrix of 2 bits codes"
+    nb_struct, len_seq = codes.shape
+    padded = zeros((nb_struct, 4 * row_bytes(len_seq)), dtype=uint8)
+    padded[:, :len_seq] = codes
+    return padded[:, 0::4] | padded[:, 1::4] << 2 | padded[:, 2::4] << 4 | padded[:, 3::4] << 6
+
+
+def pack_structures(structures):
+    "pack dot-brackets into a (nb_struct x ceil(len/4)) uint8 matrix"
+    codes = PACK_LUT[struct_matrix(structures)]
+    if (codes == 3).any():
+        raise ValueError("only '.()' structures can be packed")
+    return pack_codes(codes)
+
+
+def unpack_structures(packed, len_seq):
+    "list of dot-brackets from packed rows"
+    chars = UNPACK_LUT[packed].reshape(len(packed), 4 * packed.shape[1])[:, :len_seq]
+    return [row.tobytes().decode() for row in chars]
+
+
+def pair_tables(structures):
+    "(nb_struct x len) matrix of paired positions, -1 when unpaired"
+    smat = struct_matrix(structures)
+    ptable = full(smat.shape, -1, dtype=int32)
+    sids, pos_i, pos_j = pair_arrays(smat)
+    ptable[sids, pos_i], ptable[sids, pos_j] = pos_j, pos_i
+    return ptable
+
+
+def step_parents(prev_structs, cur_structs):
+    """For each structure, the first structure of the previous step (the lowest
+    energy one) whose pairs are all in it, -1 if none
+    """
+    nb_prev = len(prev_structs)
+    parents = full(len(cur_structs), nb_prev, dtype=int64)
+    if nb_prev == 0 or len(cur_structs) == 0:
+        return full(len(cur_structs), -1, dtype=int32)
+    prev_ids, cur_ids = subset_links(pair_matrix(prev_structs), pair_matrix(cur_structs))
+    minimum.at(parents, cur_ids, prev_ids)
+    parents[parents == nb_prev] = -1
+    return parents.astype(int32)
+
+
+class Trajectory:
+    """Trajectory stored in columns over all the structures: packed
+    dot-brackets, energies and the offsets of the steps.
+
+    traj[si]            -> list of (structure, energy) of step si
+    traj.structure(k)   -> dot-bracket of the structure k (over all steps)
+    traj.step_index     -> step of each structure
+    """
+
+    def __init__(self, sequence, packed, energies, offsets, parents=None):
+        self.sequence, self.len_seq = sequence, len(sequence)
+        self.packed, self.energies, self.parents = packed, energies, parents
+        self.offsets = offsets
+        self.nb_step, self.nb_struct = len(offsets) - 1, len(energies)
+
+    def __len__(self):
+        return self.nb_step
+
+    def __getitem__(self, step):
+        return self.step(step)
+
+    def __iter__(self):
+        for si in range(self.nb_step):
+            yield self.step(si)
+
+    @property
+    def step_index(self):
+        return repeat(arange(self.nb_step, dtype=int32), diff(self.offsets))
+
+    def step_range(self, step):
+        "indexes of the first and after last structures of a step"
+        if step < 0:
+            step += self.nb_step
+        if not 0 <= step < self.nb_step:
+            raise IndexError("step out of range")
+        return self.offsets[step], self.offsets[step+1]
+
+    def step_of(self, idx):
+        "step of the structure IDX"
+        return int(searchsorted(self.offsets, idx, side="right")) - 1
+
+    def structure(self, idx):
+        return unpack_structures(self.packed[idx:idx+1], self.len_seq)[0]
+
+    def structures(self, start=0, end=None):
+        return unpack_structures(self.packed[start:end], self.len_seq)
+
+    def step(self, step):
+        "list of (structure, energy) of a step"
+        start, end = self.step_range(step)
+        return list(zip(self.structures(start, end), self.energies[start:end].tolist()))
+
+    def step_ids(self, step):
+        start, end = self.step_range(step)
+        return arange(start, end)
+
+    def unique(self):
+        "indexes of the first occurrence of each structure"
+        first = {}
+        for idx, row in enumerate(self.packed):
+            first.setdefault(row.tobytes(), idx)
+        return array(sorted(first.values()), dtype=int)
+
+    def fast_paths(self):
+        "list of steps of Structure objects, as given by fold(traj=True)"
+        paths = []
+        for fold_step in self:
+            paths += [[]]
+            for str_struct, nrj in fold_step:
+                struct = Structure([], [])
+                struct.str_struct, struct.energy = str_struct, nrj
+                paths[-1] += [struct]
+        return paths
+
+
+class TrajBin(Trajectory):
+    "Memory-mapped binary trajectory"
+
+    def __init__(self, in_file):
+        self.data = memmap(in_file, dtype=uint8, mode="r")
+        magic, version, len_seq, nb_step, nb_struct = HEADER.unpack(bytes(self.data[:HEADER.size]))
+        if magic != MAGIC:
+            raise ValueError(f"{in_file} is not a binary RAFFT trajectory")
+        if version != VERSION:
+            raise ValueError(f"unsupported trajectory version {version}")
+        pos = HEADER.size
+        sequence = bytes(self.data[pos:pos+len_seq]).decode("ascii")
+        nb_bytes = row_bytes(len_seq)
+        pos = align(pos + len_seq)
+        packed = self.data[pos:pos+nb_struct*nb_bytes].reshape(nb_struct, nb_bytes)
+        pos = align(pos + nb_struct*nb_bytes)
+        energies = self.data[pos:pos+4*nb_struct].view(float32)
+        pos = align(pos + 4*nb_struct)
+        parents = self.data[pos:pos+4*nb_struct].view(int32)
+        pos = align(pos + 4*nb_struct)
+        offsets = self.data[pos:pos+8*(nb_step+1)].view(uint64).astype(int)
+        super().__init__(sequence, packed, energies, offsets, parents)
+
+
+def write_traj_bin(out_file, sequence, steps):
+    """Write a trajectory in the binary format. STEPS is an iterable over the
+    steps, each one a list of Structure or (structure, energy); it is consumed
+    once, so a streaming reader can be given
+    """
+    len_seq = len(sequence)
+    energies, parents, offsets = [], [], [0]
+    prev = []
+    with open(out_file, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len_seq, 0, 0))
+        out.write(sequence.encode("ascii"))
+        out.write(b"\0" * (align(out.tell()) - out.tell()))
+        for fold_step in steps:
+            step_el = [(st.str_struct, st.energy) if hasattr(st, "str_struct") else st
+                       for st in fold_step]
+            cur = [st for st, _ in step_el]
+            if cur:
+                out.write(pack_structures(cur).tobytes())
+            energies += [nrj for _, nrj in step_el]
+            parents += [step_parents(prev, cur)]
+            offsets += [offsets[-1] + len(cur)]
+            prev = cur
+        nb_step, nb_struct = len(offsets) - 1, offsets[-1]
+        parents = concatenate(parents) if parents else zeros(0, dtype=int32)
+        for data in [array(energies, dtype=float32), parents, array(offsets, dtype=uint64)]:
+            out.write(b"\0" * (align(out.tell()) - out.tell()))
+            out.write(data.tobytes())
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, len_seq, nb_step, nb_struct))
+
+
+def is_traj_bin(in_file):
+    with open(in_file, "rb") as inp:
+        return inp.read(len(MAGIC)) == MAGIC
+
+
+def read_sequence(in_file):
+    "first line of a RAFFT output"
+    with open(in_file, "rb") as inp:
+        sequence = inp.readline().strip().decode("ascii")
+    if not sequence or sequence.startswith("#"):
+        raise ValueError(f"{in_file}: the first line must be the sequence")
+    return sequence
+
+
+def read_chunks(in_file, chunk_size=CHUNK_SIZE):
+    """Blocks of whole lines of a RAFFT output after the sequence
+
+    output: iterator of (number of the first line, bytes ending by a newline)
+    """
+    with open(in_file, "rb") as inp:
+        inp.readline()
+        line_nb, rest = 2, b""
+        while True:
+            chunk = inp.read(chunk_size)
+            if not chunk:
+                break
+            data = rest + chunk
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                yield line_nb, data[:cut]
+                line_nb += data.count(b"\n", 0, cut)
+        if rest:
+            yield line_nb, rest + b"\n"
+
+
+def parse_floats(text, nums):
+    "whitespace separated energies, NUMS are the line numbers for the errors"
+    if len(nums) == 0:
+        return zeros(0, dtype=float64)
+    with catch_warnings():
+        simplefilter("error")
+        try:
+            # (fromstring reads a blank string as [-1])
+            if text.strip():
+                return fromstring(text, dtype=float64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            pass
+    for num, field in zip(nums, text.split()):
+        try:
+            float(field)
+        except ValueError:
+            raise ValueError(f"line {num}: cannot read the energy")
+    raise ValueError(f"line {nums[0]}: cannot read the energies")
+
+
+def parse_chunk(data, line_nb, len_seq, step):
+    """Parse a block of lines from step STEP on, without loop over the lines.
+
+    output:
+    codes = (nb_struct x len) matrix of the 2 bits structure codes
+    energies, steps = arrays over the structures
+    step = current step at the end of the block
+    """
+    buf = frombuffer(data, dtype=uint8)
+    ends = flatnonzero(buf == NEWLINE)
+    starts = concatenate(([0], ends[:-1] + 1))
+    lens = ends - starts
+    blank = lens == 0
+    is_step = ~blank & (buf[starts] == HASH)
+    is_struct = ~blank & ~is_step
+    line_steps = step + cumsum(is_step)
+    nums = line_nb + flatnonzero(is_struct)
+    s_starts, s_ends = starts[is_struct], ends[is_struct]
+
+    # a structure, a blank then the energy
+    bad = s_ends - s_starts <= len_seq
+    sep = buf[minimum(s_starts + len_seq, len(buf) - 1)]
+    bad |= (sep != SPACE) & (sep != TAB)
+    if bad.any():
+        raise ValueError(f"line {nums[int(bad.argmax())]}: structure of length {len_seq} expected")
+
+    # label the bytes: 1 for the structures, 2 for the energies (each one
+    # starts with its separator)
+    label = zeros(len(buf), dtype=int8)
+    label[s_starts], label[s_starts + len_seq] = 1, 1
+    label[s_ends] = -2
+    label = cumsum(label, dtype=int8)
+    codes = PACK_LUT[buf[label == 1]].reshape(-1, len_seq)
+    check_codes(codes, nums)
+    energies = parse_floats(buf[label == 2].tobytes(), nums)
+    if len(energies) != len(nums):
+        raise ValueError(f"line {nums[0]}: one energy per structure expected")
+    return codes, energies, maximum(line_steps[is_struct], 0), int(line_steps[-1])
+
+
+def check_codes(codes, nums):
+    "codes of a block of structures must be '.()'"
+    bad = (codes == 3).any(axis=1)
+    if bad.any():
+        raise ValueError(f"line {nums[int(bad.argmax())]}: invalid structure character")
+
+
+def stream_rafft_output(in_file, chunk_size=CHUNK_SIZE):
+    """Read a RAFFT text output step by step.
+
+    output:
+    sequence, steps = the sequence and an iterator over the steps, each one a
+    list of (structure, energy)
+    """
+    sequence = read_sequence(in_file)
+    len_seq = len(sequence)
+
+    def steps():
+        fold_step, cur_step = [], -1
+        for line_nb, data in read_chunks(in_file, chunk_size):
+            codes, nrjs, st_steps, last = parse_chunk(data, line_nb, len_seq, cur_step)
+            structs = [row.tobytes().decode() for row in CODE_CHARS[codes]]
+            for str_struct, nrj, step in zip(structs, nrjs.tolist(), st_steps.tolist()):
+                while step > cur_step:
+                    if cur_step >= 0:
+                        yield fold_step
+                    fold_step, cur_step = [], cur_step + 1
+                fold_step.append((str_struct, nrj))
+            # empty steps at the end of the block
+            while last > cur_step:
+                if cur_step >= 0:
+                    yield fold_step
+                fold_step, cur_step = [], cur_step + 1
+        if cur_step >= 0:
+            yield fold_step
+
+    return sequence, steps()
+
+
+def load_rafft_output(in_file, chunk_size=CHUNK_SIZE):
+    """Read a whole RAFFT text output into columns.
+
+    output: Trajectory with float64 energies
+    """
+    return parse_blocks(read_sequence(in_file), read_chunks(in_file, chunk_size))
+
+
+def parse_blocks(sequence, blocks):
+    "Trajectory from blocks of (number of the first line, lines) of the steps"
+    len_seq = len(sequence)
+    packed, energies, step_list = [], [], []
+    step = -1
+    for line_nb, data in blocks:
+        codes, nrjs, st_steps, step = parse_chunk(data, line_nb, len_seq, step)
+        packed += [pack_codes(codes)]
+        energies += [nrjs]
+        step_list += [st_steps]
+    nb_step = step + 1
+    packed = concatenate(packed) if packed else zeros((0, row_bytes(len_seq)), dtype=uint8)
+    energies = concatenate(energies) if energies else zeros(0, dtype=float64)
+    step_index = concatenate(step_list) if step_list else zeros(0, dtype=int32)
+    offsets = concatenate(([0], cumsum(bincount(step_index, minlength=nb_step))))
+    return Trajectory(sequence, packed, energies, offsets)
+
+
+def split_records(inp):
+    """Records of a stream of RAFFT text outputs (concatenated outputs of several
+    sequences), from the binary file object INP: each record is an optional
+    ">name" line, the sequence, then its steps.
+
+    output: iterator of (name or None, sequence, number of the first line of
+    the steps, bytes of the steps)
+    """
+    name, sequence, start, lines = None, None, 0, []
+    for line_nb, line in enumerate(inp, 1):
+        first = line[:1]
+        if first in b".()#" or not line.strip():
+            if sequence is None:
+                raise ValueError(f"line {line_nb}: the first line of a record must be the sequence")
+            lines += [line]
+            continue
+        if sequence is not None:
+            yield name, sequence, start, b"".join(lines)
+            name, sequence = None, None
+        if first == b">":
+            name = line[1:].strip().decode("ascii")
+        else:
+            sequence, start, lines = line.strip().decode("ascii"), line_nb + 1, []
+    if sequence is not None:
+        yield name, sequence, start, b"".join(lines)
+
+
+def read_records(in_file):
+    """Trajectories of a stream of RAFFT text outputs (a file, or stdin for "-")
+
+    output: iterator of (name or None, Trajectory)
+    """
+    from sys import stdin
+    inp = stdin.buffer if in_file == "-" else open(in_file, "rb")
+    try:
+        for name, sequence, line_nb, data in split_records(inp):
+            yield name, parse_blocks(sequence, [(line_nb, data)] if data else [])
+    finally:
+        if inp is not stdin.buffer:
+            inp.close()
+
+
+def read_trajectory(in_file):
+    "Trajectory from a binary (memory-mapped) or a text file"
+    if is_traj_bin(in_file):
+        return TrajBin(in_file)
+    return load_rafft_output(in_file)
+
+
+def write_traj_text(out, sequence, steps):
+    """write a trajectory in the text format of rafft into the file object OUT;
+    steps are lists of Structure or (structure, energy)
+    """
+    out.write(f"{sequence}\n")
+    for si, fold_step in enumerate(steps):
+        lines = ["# {:-^20}\n".format(si)]
+        for st in fold_step:
+            str_struct, nrj = (st.str_struct, st.energy) if hasattr(st, "str_struct") else st
+            lines += [f"{str_struct} {nrj:6.1f}\n"]
+        out.write("".join(lines))
+
+
+def convert(in_file, out_file):
+    "convert a trajectory from text to binary or from binary to text"
+    if is_traj_bin(in_file):
+        traj = TrajBin(in_file)
+        with open(out_file, "w") as out:
+            write_traj_text(out, traj.sequence, traj)
+    else:
+        sequence, steps = stream_rafft_output(in_file)
+        write_traj_bin(out_file, sequence, steps)
@@ -7,18 +7,26 @@ rafft_kin rafft.out --plot
 
 """
 
-from rafft.utils import paired_positions, parse_rafft_output
-from numpy import array, zeros, exp, diag
-from scipy.linalg import eig, inv
+from itertools import chain
+from sys import stderr
+from rafft.utils import paired_positions, pair_matrix, subset_links
+from numpy import array, zeros, exp
 import numpy as np
-import matplotlib.pyplot as plt
-from copy import deepcopy
+
+# temperature factor of the rates (kcal/mol)
+KT = 0.61
+# the rounding errors of the symmetrized solver are amplified by up to
+# sqrt(pi_max/pi_min), it is used below exp(MAX_LOG_RATIO)
+MAX_LOG_RATIO = 23.0
+# above this number of structures, the sparse backend is used by default
+SPARSE_THRESHOLD = 1000
 
 
 def plot_traj(trajectory, struct_list, times, font_size, width, height,
               show_thres, out_file=None):
     """plot trajectory
     """
+    import matplotlib.pyplot as plt
     trajectory = array(trajectory).real
 
     plt.rcParams["font.family"] = "serif"
@@ -45,17 +53,6 @@ def plot_traj(trajectory, struct_list, times, font_size, width, height,
         plt.show()
 
 
-def get_connected_prev(cur_struct, prev_pos):
-    "get the connected structures"
-    cur_pairs = set(paired_positions(cur_struct.str_struct))
-    res = []
-    for si, struct in enumerate(prev_pos):
-        pairs = set(paired_positions(struct.str_struct))
-        if len(pairs - cur_pairs) == 0:
-            res += [si]
-    return res
-
-
 def get_connected_next(cur_struct, prev_pos):
     "get the connected structures"
     cur_pairs = set(paired_positions(cur_struct.str_struct))
@@ -65,44 +62,86 @@ def get_connected_next(cur_struct, prev_pos):
             return True
 
 
-def get_transition_mat(fast_paths, nb_struct, struct_map):
-    transition_mat = zeros((nb_struct, nb_struct), dtype=np.longdouble)
-    KT = 0.61
-
-    for step_i, fold_step in enumerate(fast_paths):
-        for struct in fold_step:
-            # get all structures connected from previous step
-            lprev_co = get_connected_prev(struct, fast_paths[step_i - 1])
-            map_cur, cur_nrj = struct_map[struct.str_struct]
-
-            for si in lprev_co:
-                prev_st = fast_paths[step_i-1][si]
-                map_prev, prev_nrj = struct_map[prev_st.str_struct]
-                delta_nrj = cur_nrj - prev_nrj
-                if map_cur != map_prev:
-                    # # M_ij = k(i -> j)
-                    transition_mat[map_prev, map_cur] = min(1.0, exp(-delta_nrj/KT))
-                    transition_mat[map_cur, map_prev] = min(1.0, exp(delta_nrj/KT))
+def get_edges(fast_paths, struct_map, struct_list=None):
+    """indices (previous, current) of the connected structures of consecutive
+    steps: the previous structure has all its pairs in the current one. The
+    pair lists of the structures of STRUCT_LIST (in the order of the ids) are
+    used when they are complete, as in the trajectories of fold, otherwise the
+    dot-brackets are parsed
+    """
+    if struct_list is not None and all(len(struct.pair_list) == struct.str_struct.count("(")
+                                       for struct in struct_list):
+        pairs = pair_matrix([struct.pair_list for struct in struct_list],
+                            len(struct_list[0].str_struct))
+    else:
+        # the pairs are parsed once per structure
+        pairs = pair_matrix(sorted(struct_map, key=lambda el: struct_map[el][0]))
+    src, dst = [zeros(0, dtype=int)], [zeros(0, dtype=int)]
+    for prev_step, cur_step in zip(fast_paths[:-1], fast_paths[1:]):
+        prev_ids = array([struct_map[struct.str_struct][0] for struct in prev_step], dtype=int)
+        cur_ids = array([struct_map[struct.str_struct][0] for struct in cur_step], dtype=int)
+        prev_co, cur_co = subset_links(pairs[prev_ids], pairs[cur_ids])
+        src += [prev_ids[prev_co]]
+        dst += [cur_ids[cur_co]]
+    return np.concatenate(src), np.concatenate(dst)
 
-    # normalize input and output flows
-    for si in range(nb_struct):
-        transition_mat[si, si] = -transition_mat[si,:].sum()
 
-    return transition_mat
+def get_edges_graph(graph, struct_map):
+    "indices (parent, child) of the edges of a FoldingGraph"
+    # graph ids -> rows of the matrix
+    to_map = array([struct_map[str_struct][0] for str_struct in graph.structures], dtype=int)
+    src, dst = graph.edges()
+    return to_map[src], to_map[dst]
+
 
+def get_rates(src, dst, energies):
+    """Metropolis rates in both directions of the edges
 
-def kinetics(fast_paths, max_time, n_steps, initial_pop=None):
+    output:
+    rows, cols, rates = k(rows -> cols), each pair of states once
     """
-    input:
-    fast_paths = list of list of (structure, energy)
-    initial_pop = list of float giving the initial population of all/few structures
+    rows, cols = np.concatenate([src, dst]), np.concatenate([dst, src])
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    # the same edge can be found at several steps
+    _, first = np.unique(rows * max(1, len(energies)) + cols, return_index=True)
+    rows, cols = rows[first], cols[first]
+    rates = np.minimum(1.0, exp(-(energies[cols] - energies[rows])/KT))
+    return rows, cols, rates
+
+
+def get_transition_mat(src, dst, energies, sparse=False):
+    """M_ij = k(i -> j), M_ii = -sum_j k(i -> j), as a dense matrix or a
+    scipy.sparse CSR matrix
+    """
+    nb_struct = len(energies)
+    rows, cols, rates = get_rates(src, dst, energies)
+    if sparse:
+        from scipy.sparse import csr_matrix
+        out_rates = np.bincount(rows, weights=rates, minlength=nb_struct)
+        diag = np.arange(nb_struct)
+        return csr_matrix((np.concatenate([rates, -out_rates]),
+                           (np.concatenate([rows, diag]), np.concatenate([cols, diag]))),
+                          shape=(nb_struct, nb_struct))
+
+    transition_mat = zeros((nb_struct, nb_struct), dtype=np.longdouble)
+    transition_mat[rows, cols] = rates
+    # normalize input and output flows
+    transition_mat[np.diag_indices(nb_struct)] = -transition_mat.sum(axis=1)
+    return transition_mat
+
+
+def kinetic_model(fast_paths, graph=None, sparse=False):
+    """unique structures and transition matrix of a landscape
 
     output:
-    trajectory = trajectory of population
-    times = time steps
-    struct_list = list of unique structures
-    str_equi_pop = final population
+    struct_list = list of unique structures, in order of appearance
+    struct_map = structure -> (index, energy)
+    transition_mat = M_ij = k(i -> j), M_ii = -sum_j k(i -> j) (CSR if SPARSE,
+    or above SPARSE_THRESHOLD structures if SPARSE is None)
     """
+    if fast_paths is None:
+        fast_paths = graph.fast_paths()
     seen = set()
     struct_list = []
     for el in fast_paths:
@@ -110,41 +149,529 @@ def kinetics(fast_paths, max_time, n_steps, initial_pop=None):
             if struct.str_struct not in seen:
                 seen.add(struct.str_struct)
                 struct_list += [struct]
-    
+
     # create a non-redundant mapping
     struct_map = {struct.str_struct: (si, struct.energy) for si, struct in enumerate(struct_list)}
-    nb_struct = len(struct_list)
-    transition_mat = get_transition_mat(fast_paths, nb_struct, struct_map)
+    energies = array([struct.energy for struct in struct_list], dtype=float)
+    if sparse is None:
+        sparse = len(struct_list) > SPARSE_THRESHOLD
+    if graph is not None:
+        src, dst = get_edges_graph(graph, struct_map)
+    else:
+        src, dst = get_edges(fast_paths, struct_map, struct_list)
+    transition_mat = get_transition_mat(src, dst, energies, sparse)
+    return struct_list, struct_map, transition_mat
 
-    # initialize the kinetic
+
+def initial_population(nb_struct, initial_pop=None):
+    """population vector from a list of (index, weight), or "uniform", the
+    unfolded state by default"""
+    init_pop = zeros(nb_struct, dtype=np.longdouble)
     if initial_pop is None:
-        # starts with the unfolded state
-        init_pop = array([1.0] + [0.0 for _ in range(nb_struct-1)], dtype=np.longdouble)
+        init_pop[0] = 1.0
+    elif initial_pop == "uniform":
+        init_pop[:] = 1.0 / nb_struct
     else:
-        init_pop = array([0.0 for _ in range(nb_struct)], dtype=np.longdouble)
         for p, w in initial_pop:
             init_pop[p] = w
+    return init_pop
 
-    trajectory = [deepcopy(init_pop)]
-
-    # diagonalize the transition matrix to solve the system
-    V, W = eig(transition_mat.T, check_finite=True)
-    iW = inv(W)
 
+def time_grid(max_time, n_steps):
+    "exp(-4) followed by n_steps times exp(max_time/n_steps * st - 4)"
     time_step = max_time / n_steps
-    
-    times = [exp(-4)]
-    for st in range(n_steps):
-        time = exp(time_step * st-4)
-        times += [time]
-        tmp_pop = W @ diag(exp(V * time)) @ (iW @ init_pop)
-        trajectory += [tmp_pop.real/tmp_pop.real.sum()]
+    return [exp(-4)] + [exp(time_step * st - 4) for st in range(n_steps)]
+
+
+def adaptive_grid(propagator, init_pop, t_min, t_max, tol=0.01, nb_start=16, max_depth=12):
+    """time points between T_MIN and T_MAX where the populations change, and the
+    populations there, array (nb_times, nb_struct)
+
+    The grid starts with NB_START points evenly spaced in log time. Each
+    interval is then cut at its middle (in log time) while the populations
+    there differ by more than TOL from the interpolation of its ends, MAX_DEPTH
+    times at most. Each round of cuts is computed in one call of
+    PROPAGATOR.populations, so any propagator can be used.
+    """
+    times = np.geomspace(t_min, t_max, nb_start)
+    pops = propagator.populations(init_pop, times)
+    active = np.ones(len(times) - 1, dtype=bool)
+    for _ in range(max_depth):
+        if not active.any():
+            break
+        mids = np.sqrt(times[:-1][active] * times[1:][active])
+        mid_pops = propagator.populations(init_pop, mids)
+        # at the middle in log time, the interpolation is the mean of the ends
+        interp = (pops[:-1][active] + pops[1:][active]) / 2.0
+        refine = np.abs(mid_pops - interp).max(axis=1) > tol
+        # all the computed points are kept, only the cut intervals are checked again
+        order = np.argsort(np.concatenate([times, mids]), kind="stable")
+        times = np.concatenate([times, mids])[order]
+        pops = np.concatenate([pops, mid_pops])[order]
+        is_new = np.concatenate([np.zeros(len(order) - len(mids), dtype=bool), refine])[order]
+        active = is_new[:-1] | is_new[1:]
+    return times, pops
+
+
+def relaxation_times(times, trajectory, fractions=(0.5, 0.9)):
+    """times at which the trajectory has done each fraction of its relaxation,
+    measured by the distance (half L1) to its last population and interpolated
+    in log time. The slow eigenvalues of trapped landscapes are below the double
+    precision, so the time scales are read on the trajectory, not the spectrum.
+    """
+    trajectory = array(trajectory, dtype=float)
+    dist = 0.5 * np.abs(trajectory - trajectory[-1]).sum(axis=1)
+    log_times = np.log(array(times, dtype=float))
+    res = []
+    for frac in fractions:
+        level = (1.0 - frac) * dist[0]
+        below = np.flatnonzero(dist <= level)
+        # the distance is not monotonous with stochastic trajectories
+        pos = below[0]
+        if pos == 0:
+            res += [float(times[0])]
+        else:
+            ratio = (dist[pos-1] - level) / (dist[pos-1] - dist[pos])
+            res += [float(exp(log_times[pos-1] + ratio * (log_times[pos] - log_times[pos-1])))]
+    return res
+
+
+def is_reversible(transition_mat, energies, kt=KT, rtol=1e-8):
+    "detailed balance pi_i M_ij = pi_j M_ji, with pi_i ~ exp(-E_i/kt)"
+    rates = array(transition_mat, dtype=float)
+    np.fill_diagonal(rates, 0.0)
+    if ((rates > 0) != (rates.T > 0)).any():
+        return False
+    rows, cols = np.nonzero(rates)
+    # in the log domain: log M_ij - E_i/kt = log M_ji - E_j/kt
+    flux = np.log(rates[rows, cols]) - energies[rows] / kt
+    rev_flux = np.log(rates[cols, rows]) - energies[cols] / kt
+    return np.allclose(flux, rev_flux, rtol=0.0, atol=rtol)
+
+
+def components(transition_mat):
+    "connected component of each state (the rates go both ways)"
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    rates = csr_matrix(array(transition_mat, dtype=float)
+                       if isinstance(transition_mat, np.ndarray) else transition_mat)
+    return connected_components(rates, directed=False)[1]
+
+
+def equilibrium(transition_mat, energies, init_pop, kt=KT):
+    """stationary populations reached from INIT_POP, without time integration:
+    the rates satisfy detailed balance, so each connected component ends at
+    Boltzmann equilibrium with the initial population of the component
+    """
+    energies = array(energies, dtype=float)
+    comps = components(transition_mat)
+    init_pop = array(init_pop, dtype=float)
+    nb_comp = comps.max() + 1
+    min_nrj = np.full(nb_comp, np.inf)
+    np.minimum.at(min_nrj, comps, energies)
+    boltz = exp(-(energies - min_nrj[comps]) / kt)
+    part = np.bincount(comps, weights=boltz, minlength=nb_comp)
+    mass = np.bincount(comps, weights=init_pop, minlength=nb_comp)
+    return boltz / part[comps] * mass[comps] / init_pop.sum()
+
+
+def mean_first_passage(transition_mat, targets):
+    """mean first-passage time of each state to the set of states TARGETS (inf
+    if they cannot be reached), from one sparse solve: sum_j M_ij tau_j = -1 on
+    the other states of the components of the targets, tau = 0 on the targets
+    """
+    from scipy.sparse import csc_matrix
+    from scipy.sparse.linalg import splu
+    comps = components(transition_mat)
+    nb_struct = len(comps)
+    is_target = zeros(nb_struct, dtype=bool)
+    is_target[list(targets)] = True
+    free = np.isin(comps, comps[is_target]) & ~is_target
+    tau = np.full(nb_struct, np.inf)
+    tau[is_target] = 0.0
+    if free.any():
+        sub_mat = csc_matrix(array(transition_mat, dtype=float)[np.ix_(free, free)]
+                             if isinstance(transition_mat, np.ndarray)
+                             else transition_mat[free][:, free])
+        tau[free] = splu(sub_mat, permc_spec="MMD_AT_PLUS_A").solve(-np.ones(free.sum()))
+    return tau
+
+
+class Lumping:
+    """Coarse-grained kinetic model: the states are merged into basins, assumed
+    at local equilibrium, and the effective rates between basins are
+    K_AB = sum_{i in A, j in B} pi_i/pi_A k_ij with pi_i ~ exp(-E_i/kt), which
+    keeps the detailed balance with the basin free energies
+    F_A = -kt log sum_{i in A} exp(-E_i/kt).
+
+    The basins are the connected components of the transitions faster than
+    FAST_RATE in both directions, the lumped model is valid at times longer than
+    1/FAST_RATE (the populations of the structures of a basin are then at local
+    equilibrium). Lower rates give fewer basins, but they also merge
+    structures reached by different folding branches, which changes how the
+    population is first split between them.
+    """
 
-    equi_pop = trajectory[-1]
+    def __init__(self, transition_mat, energies, fast_rate=0.5, kt=KT):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+        energies = array(energies, dtype=float)
+        nb_struct = len(energies)
+        rates = csr_matrix(array(transition_mat, dtype=float)
+                           if isinstance(transition_mat, np.ndarray) else transition_mat)
+        rates.setdiag(0.0)
+        rates.eliminate_zeros()
+        _, basins = connected_components(rates.minimum(rates.T) >= fast_rate, directed=False)
+        self.basins, nb_basin = basins, basins.max() + 1 if nb_struct else 0
 
-    # g = nx.from_numpy_matrix(transition_mat)
-    # nx.draw(g)
-    # plt.show()
+        # local Boltzmann weights, from the minimum of each basin
+        min_nrj = np.full(nb_basin, np.inf)
+        np.minimum.at(min_nrj, basins, energies)
+        boltz = exp(-(energies - min_nrj[basins]) / kt)
+        part = np.bincount(basins, weights=boltz, minlength=nb_basin)
+        self.weights = boltz / part[basins]
+        self.energies = min_nrj - kt * np.log(part)
+        # lowest energy structure of each basin
+        order = np.lexsort((energies, basins))
+        self.representatives = order[np.unique(basins[order], return_index=True)[1]]
+
+        rates = rates.tocoo()
+        src, dst = basins[rates.row], basins[rates.col]
+        keep = src != dst
+        flux = csr_matrix((self.weights[rates.row[keep]] * rates.data[keep], (src[keep], dst[keep])),
+                          shape=(nb_basin, nb_basin))
+        out_rates = np.asarray(flux.sum(axis=1)).ravel()
+        self.transition_mat = (flux - csr_matrix((out_rates, (np.arange(nb_basin), np.arange(nb_basin))),
+                                                 shape=(nb_basin, nb_basin))).tocsr()
+
+    def __len__(self):
+        return len(self.energies)
+
+    @property
+    def ratio(self):
+        "number of structures per basin"
+        return len(self.basins) / max(1, len(self))
+
+    def reduce(self, pop):
+        "basin populations from structure populations"
+        return np.bincount(self.basins, weights=array(pop, dtype=float), minlength=len(self))
+
+    def expand(self, pops):
+        "structure populations from basin populations (last axis), at local equilibrium"
+        return pops[..., self.basins] * self.weights
+
+    def report(self):
+        return f"{len(self.basins)} structures lumped into {len(self)} basins (ratio {self.ratio:.1f})"
+
+
+def symmetric_solver(transition_mat, energies, kt=KT):
+    """whether Propagator can use the symmetrized solver: detailed balance and
+    energies spanning less than 2 kt MAX_LOG_RATIO"""
+    return asymmetric_reason(transition_mat, energies, kt) is None
+
+
+def asymmetric_reason(transition_mat, energies, kt=KT):
+    "why the symmetrized solver can't be used, None if it can"
+    if energies is None or len(energies) == 0:
+        return "no energies"
+    energies = array(energies, dtype=float)
+    if np.ptp(energies) / (2.0 * kt) >= MAX_LOG_RATIO:
+        return (f"energies spanning {np.ptp(energies):.1f} kcal/mol, above "
+                f"{2.0 * kt * MAX_LOG_RATIO:.1f}")
+    if not is_reversible(transition_mat, energies, kt):
+        return "rates without detailed balance"
+    return None
+
+
+class Propagator:
+    """Solution of the master equation dp/dt = M^T p from the eigendecomposition
+    M^T = W diag(V) W^-1, computed once and reused for any initial population
+    and time grid: p(t) = W (exp(V t) * W^-1 p0)
+
+    When the ENERGIES of the states are given and the rates satisfy detailed
+    balance, M^T = D^1/2 S D^-1/2 with D = diag(pi) and S symmetric
+    (S_ij = sqrt(M_ij M_ji)): S = U diag(V) U^T is solved by eigh, the modes are
+    real, W = D^1/2 U and W^-1 = U^T D^-1/2 need no inversion. Otherwise the
+    general eig solver is used (self.symmetric tells which one), as well as
+    when the energies span more than 2 kt MAX_LOG_RATIO, where the errors of
+    the back transformation by D^1/2 become too large. eig is much less
+    accurate than the Krylov propagation, make_propagator avoids it.
+    """
+
+    def __init__(self, transition_mat, energies=None, kt=KT):
+        from scipy.linalg import eig, eigh, inv
+        self.symmetric = symmetric_solver(transition_mat, energies, kt)
+        if self.symmetric:
+            energies = array(energies, dtype=float)
+            # D^1/2 in the log domain, centered to use the whole float range
+            log_half = -(energies - (energies.min() + energies.max()) / 2.0) / (2.0 * kt)
+            rates = array(transition_mat, dtype=float)
+            sym_mat = np.sqrt(rates * rates.T)
+            np.fill_diagonal(sym_mat, np.diag(rates))
+            self.eigvals, sym_modes = eigh(sym_mat, check_finite=True)
+            # the generator is negative semidefinite, positive values are rounding errors
+            self.eigvals = np.minimum(self.eigvals, 0.0)
+            self.modes = exp(log_half)[:, None] * sym_modes
+            self.inv_modes = sym_modes.T * exp(-log_half)[None, :]
+        else:
+            self.eigvals, self.modes = eig(transition_mat.T, check_finite=True)
+            self.inv_modes = inv(self.modes)
+
+    def __len__(self):
+        return len(self.eigvals)
+
+    def coefficients(self, init_pop):
+        "modal coefficients of an initial population"
+        return self.inv_modes @ init_pop
+
+    def populations(self, init_pop, times, coefs=None):
+        "normalized populations at each time, array (len(times), nb_struct)"
+        if coefs is None:
+            coefs = self.coefficients(init_pop)
+        # all the times in one (N x T) product
+        pops = ((self.modes * coefs) @ exp(np.outer(self.eigvals, times))).real
+        return (pops / pops.sum(axis=0)).T
+
+    def stream(self, init_pop, times, chunk_size=64):
+        "iterate over (time, population), CHUNK_SIZE time points at once"
+        coefs = self.coefficients(init_pop)
+        for start in range(0, len(times), chunk_size):
+            chunk = times[start:start+chunk_size]
+            yield from zip(chunk, self.populations(None, chunk, coefs))
+
+
+class KrylovPropagator:
+    """Solution of the master equation for a sparse (CSR) transition matrix,
+    without any decomposition of the whole matrix.
+
+    exp(t A) p0 (A = M^T) is projected on the shift-and-invert Krylov subspace
+    of (I - gamma A)^-1, whose convergence does not depend on the norm of A (van
+    den Eshof & Hochbruck, SIAM J. Sci. Comput. 2006): with the Arnoldi basis V
+    and Hessenberg matrix H, exp(t A) p0 ~ |p0| V exp(t (I - H^-1)/gamma) e1,
+    evaluated for all the times of a segment from the eigenvectors of H.
+    The time grid is cut in segments where the elapsed time grows by at most
+    SPAN, each one gets its own shift gamma (one sparse LU) and subspace, which
+    grows until the integrated residual is below TOL.
+    """
+
+    def __init__(self, transition_mat, max_dim=60, tol=1e-8, span=100.0):
+        from scipy.sparse import csr_matrix
+        self.gen = csr_matrix(transition_mat).T.tocsc()
+        self.max_dim, self.tol, self.span = max_dim, tol, span
+        # number of linear solves, for the reports
+        self.nb_solve = 0
+
+    def __len__(self):
+        return self.gen.shape[0]
+
+    def segment(self, vec, dts):
+        "populations after each time in DTS (sorted, > 0) starting from VEC"
+        from scipy.sparse import identity
+        from scipy.sparse.linalg import splu
+        nb_struct = len(vec)
+        gamma = dts[-1] / 10.0
+        # the pattern is symmetric and close to a tree: little fill-in with MMD on A + A^T
+        solve = splu((identity(nb_struct, format="csc") - gamma * self.gen).tocsc(),
+                     permc_spec="MMD_AT_PLUS_A").solve
+        beta = np.linalg.norm(vec)
+        max_dim = min(self.max_dim, nb_struct)
+        basis = zeros((nb_struct, max_dim + 1))
+        hess = zeros((max_dim + 1, max_dim))
+        basis[:, 0] = vec / beta
+
+        def project(dim):
+            """coefficients in the basis of the first DIM vectors for each time,
+            and e_dim^T H^-1 of them (for the residual)
+            """
+            ritz, vecs = np.linalg.eig(hess[:dim, :dim])
+            ritz = np.where(np.abs(ritz) < 1e-300, 1e-300, ritz)
+            # the spectrum of (I - gamma A)^-1 is in (0, 1]: the exponents are
+            # negative, positive ones come from rounding on decayed modes
+            expo = (1.0 - 1.0 / ritz) / gamma
+            expo = np.minimum(expo.real, 0.0) + 1j * expo.imag
+            first = np.linalg.solve(vecs, np.eye(dim)[:, 0])
+            exp_t = exp(np.outer(expo, dts))
+            return ((vecs * first) @ exp_t).real.T, np.abs((vecs[-1] * first / ritz) @ exp_t)
+
+        for j in range(max_dim):
+            w_vec = solve(basis[:, j])
+            self.nb_solve += 1
+            w_norm = np.linalg.norm(w_vec)
+            # Gram-Schmidt twice: for short times (I - gamma A)^-1 is close to
+            # the identity and one pass loses the orthogonality
+            for _ in range(2):
+                coefs = basis[:, :j + 1].T @ w_vec
+                w_vec -= basis[:, :j + 1] @ coefs
+                hess[:j + 1, j] += coefs
+            hess[j + 1, j] = np.linalg.norm(w_vec)
+            dim = j + 1
+            if hess[j + 1, j] < 1e-12 * w_norm:
+                # the subspace is invariant, the projection is exact
+                break
+            basis[:, j + 1] = w_vec / hess[j + 1, j]
+            coefs, last = project(dim)
+            # residual of the ODE: beta h/gamma (I - gamma A) v_dim+1 e_dim^T H^-1 y(t),
+            # integrated over the elapsed time
+            next_vec = basis[:, dim] - gamma * (self.gen @ basis[:, dim])
+            err = beta * hess[dim, j] / gamma * np.linalg.norm(next_vec) * last * dts
+            # the estimate misses modes that underflow in exp(H): the total
+            # population is conserved by the exact solution
+            mass = beta * (coefs @ basis[:, :dim].sum(axis=0)) - vec.sum()
+            if err.max() < self.tol and np.abs(mass).max() < self.tol:
+                return beta * (coefs @ basis[:, :dim].T)
+        return beta * (project(dim)[0] @ basis[:, :dim].T)
+
+    def stream(self, init_pop, times, chunk_size=None):
+        "iterate over (time, population), the times must be sorted (by segments, CHUNK_SIZE is ignored)"
+        vec, t_now = array(init_pop, dtype=float), 0.0
+        times = array(times, dtype=float)
+        start = 0
+        while start < len(times):
+            if times[start] <= t_now:
+                pops, stop = [vec], start + 1
+            elif np.abs(self.gen @ vec).sum() * (times[-1] - t_now) < self.tol:
+                # stationary until the end of the grid
+                pops, stop = [vec] * (len(times) - start), len(times)
+            else:
+                # elapsed times within a factor SPAN
+                dts = times[start:] - t_now
+                stop = start + int(np.searchsorted(dts, self.span * dts[0], side="right"))
+                pops = self.segment(vec, dts[:stop - start])
+                vec, t_now = pops[-1], times[stop - 1]
+            for time, pop in zip(times[start:stop], pops):
+                pop = pop.clip(min=0.0)
+                yield time, pop / pop.sum()
+            start = stop
+
+    def populations(self, init_pop, times):
+        "normalized populations at each time, array (len(times), nb_struct)"
+        return array([pop for _, pop in self.stream(init_pop, times)])
+
+
+def fold_kinetics(sequence, max_time=30.0, n_steps=100, nb_mode=100, max_stack=1,
+                  max_branch=100, min_hp=3, min_nrj=0.0, temp=37.0, gc_wei=3.0,
+                  au_wei=2.0, gu_wei=1.0, graph=None, **kin_args):
+    """fold SEQUENCE and run the kinetics on its folding trajectory, passed in
+    memory: the connectivity comes from the pair lists of the fold (or from the
+    folding paths when a FoldingGraph GRAPH is given). KIN_ARGS are the other
+    arguments of kinetics, the output is the one of kinetics
+    """
+    from rafft.rafft import fold
+    _, fast_paths = fold(sequence, nb_mode, max_stack, max_branch, min_hp, min_nrj, True,
+                         temp, gc_wei, au_wei, gu_wei, graph=graph)
+    return kinetics(fast_paths, max_time, n_steps, graph=graph, **kin_args)
+
+
+def make_propagator(transition_mat, energies, backend="auto", nb_traj=1000, seed=None, nb_proc=1):
+    """propagator of the backend for a dense or sparse transition matrix; a dense
+    matrix out of reach of the symmetric solver (see symmetric_solver) is
+    propagated by Krylov, unless the dense BACKEND is asked for"""
+    if backend == "gillespie":
+        from rafft.gillespie import StochasticPropagator
+        return StochasticPropagator(transition_mat, nb_traj, seed, nb_proc)
+    if isinstance(transition_mat, np.ndarray):
+        reason = asymmetric_reason(transition_mat, energies)
+        if reason is None:
+            return Propagator(transition_mat, energies)
+        if backend == "dense":
+            print(f"warning: {reason}, the symmetric solver can't be used and the general eig "
+                  "solver is inaccurate, use --backend sparse", file=stderr)
+            return Propagator(transition_mat, energies)
+        # the errors of eig are much larger than those of the Krylov propagation
+        from scipy.sparse import csr_matrix
+        transition_mat = csr_matrix(array(transition_mat, dtype=float))
+    return KrylovPropagator(transition_mat)
+
+
+def kinetics(fast_paths, max_time, n_steps, initial_pop=None, graph=None, out=None,
+             backend="auto", generator_out=None, nb_traj=1000, seed=None, nb_proc=1,
+             lump_rate=None, adaptive=None, stats=None):
+    """
+    input:
+    fast_paths = list of list of (structure, energy)
+    initial_pop = list of float giving the initial population of all/few structures
+    graph = FoldingGraph whose edges are used as connectivity (fast_paths can
+    then be None)
+    generator_out = file where the transition matrix is saved (scipy.sparse .npz)
+    the other arguments are those of solve_kinetics
+
+    output:
+    trajectory = trajectory of population, array (len(times), nb_struct), or None with OUT
+    times = time steps
+    struct_list = list of unique structures
+    str_equi_pop = final population
+    """
+    sparse = None if backend == "auto" else backend in ["sparse", "gillespie"]
+    struct_list, struct_map, transition_mat = kinetic_model(fast_paths, graph,
+                                                           True if lump_rate is not None else sparse)
+    if generator_out is not None:
+        from scipy.sparse import csr_matrix, save_npz
+        save_npz(generator_out, csr_matrix(array(transition_mat, dtype=float))
+                 if isinstance(transition_mat, np.ndarray) else transition_mat)
+    return solve_kinetics(struct_list, struct_map, transition_mat, max_time, n_steps, initial_pop,
+                          out, backend, nb_traj, seed, nb_proc, lump_rate, adaptive, stats)
+
+
+def solve_kinetics(struct_list, struct_map, transition_mat, max_time, n_steps, initial_pop=None,
+                   out=None, backend="auto", nb_traj=1000, seed=None, nb_proc=1,
+                   lump_rate=None, adaptive=None, stats=None):
+    """trajectory of a model of kinetic_model (sparse with LUMP_RATE)
+
+    input:
+    out = file where the populations are written (time then populations) as
+    they are computed, the trajectory is not kept then
+    backend = dense (eigendecomposition), sparse (Krylov propagation), gillespie
+    (NB_TRAJ stochastic trajectories from SEED on NB_PROC processes) or auto
+    (sparse above SPARSE_THRESHOLD structures)
+    lump_rate = solve the kinetics of the basins of structures connected by
+    rates above LUMP_RATE (see Lumping), with a report on stderr
+    adaptive = tolerance on the populations of an adaptive time grid (see
+    adaptive_grid) used instead of the N_STEPS regular points (with the
+    gillespie backend, the sampling noise must stay below it)
+    stats = dict which receives the number of stochastic trajectories stopped
+    at the jump limit (nb_truncated, 0 for the other backends)
+
+    output: as kinetics
+    """
+    sparse = None if backend == "auto" else backend in ["sparse", "gillespie"]
+    energies = array([struct_map[struct.str_struct][1] for struct in struct_list])
+
+    lumping = None
+    if lump_rate is not None:
+        lumping = Lumping(transition_mat, energies, lump_rate)
+        print(lumping.report(), file=stderr)
+        transition_mat, energies = lumping.transition_mat, lumping.energies
+        if not (len(lumping) > SPARSE_THRESHOLD if sparse is None else sparse):
+            transition_mat = transition_mat.toarray().astype(np.longdouble)
+    # kinetic_model and Propagator can be used directly to reuse the
+    # decomposition for other initial populations or time grids
+    propagator = make_propagator(transition_mat, energies, backend, nb_traj, seed, nb_proc)
+
+    # initialize the kinetic
+    init_pop = initial_population(len(struct_list), initial_pop)
+    model_pop = init_pop if lumping is None else lumping.reduce(init_pop)
+    expand = (lambda pops: pops) if lumping is None else lumping.expand
+    times = time_grid(max_time, n_steps)
+    if adaptive is not None:
+        grid, pops = adaptive_grid(propagator, model_pop, times[0], times[-1], adaptive)
+        # the grid starts at times[0], given by the initial population as with
+        # the regular grid
+        times = grid.tolist()
+        steps = zip(grid[1:], pops[1:])
+    elif out is None:
+        steps = zip(times[1:], propagator.populations(model_pop, times[1:]))
+    else:
+        steps = propagator.stream(model_pop, times[1:])
+    steps = chain([(times[0], init_pop)], ((time, expand(pop)) for time, pop in steps))
+    if out is None:
+        trajectory = np.vstack([pop for _, pop in steps])
+        equi_pop = trajectory[-1]
+    else:
+        trajectory = None
+        for time, equi_pop in steps:
+            out.write(f"{time:.6e} " + " ".join(f"{p:.6e}" for p in equi_pop) + "\n")
 
+    if stats is not None:
+        stats["nb_truncated"] = propagator.nb_truncated if backend == "gillespie" else 0
     str_equi_pop = [(struct.str_struct, struct.energy, ep, struct_map[struct.str_struct][0]) for struct, ep in zip(struct_list, equi_pop.real)]
     return trajectory, times, struct_list, str_equi_pop
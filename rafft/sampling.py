@@ -0,0 +1,80 @@
+"""Stochastic RAFFT.
+
+Instead of keeping the best stems and structures, each replica draws one stem
+per unpaired segment and the saved structures with probabilities proportional
+to exp(-E/kT). Replicas are seeded independently, so the samples do not depend
+on the number of processes. Each worker keeps one segment correlation cache for
+all the replicas it runs.
+"""
+
+from multiprocessing import Pool
+from numpy.random import SeedSequence, default_rng
+from rafft.rafft import bfs_pairs
+from rafft.utils import prep_sequence, Glob_parms, Node, Structure
+
+
+def init_worker(sequence, fold_args, kt):
+    "one folding context (and correlation cache) per worker"
+    global GLOB_PARMS, ENCODING
+    nb_mode, max_stack, max_branch, min_hp, min_nrj, temp, gc_wei, au_wei, gu_wei = fold_args
+    GLOB_PARMS = Glob_parms(sequence, nb_mode, max_stack, max_branch, min_hp,
+                            min_nrj, True, temp, gc_wei, au_wei, gu_wei)
+    GLOB_PARMS.sample_kt = kt
+    ENCODING = prep_sequence(sequence, gc_wei, au_wei, gu_wei)
+
+
+def run_replica(seed):
+    "one stochastic fold, returns the final and visited structures"
+    glob_parms = GLOB_PARMS
+    glob_parms.rng = default_rng(seed)
+    eseq, cseq = ENCODING
+    unfold_struct = Structure(node_list=[Node(eseq, cseq, list(range(glob_parms.len_seq)))],
+                              pair_list=[])
+    unfold_struct.str_struct = "."*glob_parms.len_seq
+    structures, trajectory = bfs_pairs([unfold_struct], glob_parms, step=0,
+                                       glob_traj=[], seen=set())
+    final = [(st.str_struct, st.energy) for st in structures]
+    visited = {st.str_struct: st.energy for fold_step in trajectory for st in fold_step}
+    return final, list(visited.items())
+
+
+def sample(sequence, nb_sample=100, kt=0.6, seed=None, nb_proc=1, nb_mode=100,
+           max_stack=1, max_branch=100, min_hp=3, min_nrj=0.0, temp=37.0,
+           gc_wei=3.0, au_wei=2.0, gu_wei=1.0):
+    """Run NB_SAMPLE stochastic folds.
+
+    output:
+    samples = list of (structure, energy, final count, visit count) sorted by
+    energy; the final count is the number of replicas ending with the
+    structure, the visit count the number of replicas visiting it
+    """
+    fold_args = (nb_mode, max_stack, max_branch, min_hp, min_nrj, temp,
+                 gc_wei, au_wei, gu_wei)
+    seeds = SeedSequence(seed).spawn(nb_sample)
+
+    if nb_proc > 1:
+        with Pool(nb_proc, initializer=init_worker,
+                  initargs=(sequence, fold_args, kt)) as pool:
+            replicas = pool.imap_unordered(run_replica, seeds,
+                                           chunksize=max(1, nb_sample // (4 * nb_proc)))
+            counts = aggregate(replicas)
+    else:
+        init_worker(sequence, fold_args, kt)
+        counts = aggregate(run_replica(seed) for seed in seeds)
+
+    samples = [(st, nrj, nb_final, nb_visit) for st, (nrj, nb_final, nb_visit) in counts.items()]
+    samples.sort(key=lambda el: (el[1], el[0]))
+    return samples
+
+
+def aggregate(replicas):
+    "count the final and visited structures over the replicas"
+    counts = {}
+    for final, visited in replicas:
+        for st, nrj in visited:
+            _, nb_final, nb_visit = counts.get(st, (nrj, 0, 0))
+            counts[st] = (nrj, nb_final, nb_visit + 1)
+        for st, nrj in final:
+            _, nb_final, nb_visit = counts[st]
+            counts[st] = (nrj, nb_final + 1, nb_visit)
+    return counts
@@ -0,0 +1,333 @@
+"""Local folding server.
+
+The server keeps a pool of warm worker processes and listens on a Unix socket
+or on a localhost TCP port. Requests and responses are JSON objects, one per
+line:
+
+{"id": 1, "op": "fold", "args": {"sequence": "GGGAAAUCCC", "max_stack": 5}}
+{"id": 1, "result": {"structures": [["(((....)))", -1.2]]}}
+
+Supported operations are "fold" (arguments of rafft.fold), "kinetics" (a
+"trajectory" given as a list of steps of [structure, energy], or a "sequence"
+folded first, plus the arguments of rafft_kin.kinetics) and "stats"; unknown
+argument names are rejected. Incoming fold and kinetics requests are grouped in
+batches, split between the workers.
+
+Usage:
+rafft serve --socket /tmp/rafft.sock -np 4
+"""
+
+import argparse
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from os import remove
+from os.path import exists
+from sys import stderr
+from time import perf_counter
+from numpy import percentile
+
+FOLD_ARGS = ["nb_mode", "max_stack", "max_branch", "min_hp", "min_nrj", "traj",
+             "temp", "gc_wei", "au_wei", "gu_wei"]
+KIN_ARGS = ["max_time", "n_steps", "initial_pop", "backend", "nb_traj", "seed"]
+
+
+def check_args(args, known):
+    "a misspelled argument would silently fall back on its default"
+    unknown = sorted(set(args) - set(known))
+    if unknown:
+        raise ValueError(f"unknown arguments: {', '.join(unknown)}")
+
+
+def warm_worker():
+    "import everything and fold once so the first request is not slower"
+    from rafft import fold
+    import rafft.rafft_kin
+    fold("GGGGAAAACCCC")
+
+
+def run_fold(args):
+    from rafft import fold
+    check_args(args, FOLD_ARGS + ["sequence"])
+    fold_args = {k: args[k] for k in FOLD_ARGS if k in args}
+    res = fold(args["sequence"], **fold_args)
+    if fold_args.get("traj", False):
+        structures, trajectory = res
+        return {"structures": [(st.str_struct, st.energy) for st in structures],
+                "trajectory": [[(st.str_struct, st.energy) for st in fold_step]
+                               for fold_step in trajectory]}
+    return {"structures": [(st.str_struct, st.energy) for st in res]}
+
+
+def run_kinetics(args):
+    from rafft.rafft_kin import kinetics, fold_kinetics
+    from rafft.utils import Structure
+    if "trajectory" in args:
+        check_args(args, KIN_ARGS + ["trajectory"])
+    else:
+        check_args(args, KIN_ARGS + [k for k in FOLD_ARGS if k != "traj"] + ["sequence"])
+    kin_args = {k: args[k] for k in KIN_ARGS if k in args}
+    kin_args.setdefault("max_time", 30.0)
+    kin_args.setdefault("n_steps", 100)
+    if "trajectory" in args:
+        fast_paths = []
+        for fold_step in args["trajectory"]:
+            tmp_step = []
+            for str_struct, energy in fold_step:
+                struct = Structure([], [])
+                struct.str_struct, struct.energy = str_struct, energy
+                tmp_step += [struct]
+            fast_paths += [tmp_step]
+        _, times, _, equi_pop = kinetics(fast_paths, **kin_args)
+    else:
+        # the trajectory of the fold stays in memory, with its pair lists
+        fold_args = {k: args[k] for k in FOLD_ARGS if k in args and k != "traj"}
+        _, times, _, equi_pop = fold_kinetics(args["sequence"], **fold_args, **kin_args)
+    return {"equi_pop": [(st, nrj, float(pop), si) for st, nrj, pop, si in equi_pop]}
+
+
+OPERATIONS = {"fold": run_fold, "kinetics": run_kinetics}
+
+
+def run_batch(batch):
+    "run a batch of requests in a worker"
+    results = []
+    for op, args in batch:
+        try:
+            results += [(True, OPERATIONS[op](args))]
+        except Exception as e:
+            results += [(False, f"{type(e).__name__}: {e}")]
+    return results
+
+
+class FoldServer:
+    "batch incoming requests and dispatch them to a pool of warm workers"
+
+    def __init__(self, nb_proc=1, batch_size=16, batch_wait=0.005, window=10000):
+        self.nb_proc, self.batch_size, self.batch_wait = nb_proc, batch_size, batch_wait
+        self.pool = None
+        self.queue = None
+        self.in_flight = 0
+        self.nb_done, self.nb_error, self.nb_batch = 0, 0, 0
+        self.latencies = deque(maxlen=window)
+
+    def start_pool(self):
+        self.pool = ProcessPoolExecutor(self.nb_proc, initializer=warm_worker)
+        # make sure all the workers are spawned and warm before serving
+        list(self.pool.map(abs, range(self.nb_proc)))
+
+    def stats(self):
+        res = {"queue_depth": self.queue.qsize(), "in_flight": self.in_flight,
+               "done": self.nb_done, "errors": self.nb_error, "batches": self.nb_batch}
+        if len(self.latencies) > 0:
+            p50, p90, p99 = percentile(self.latencies, [50, 90, 99])
+            res.update({"latency_p50": p50, "latency_p90": p90, "latency_p99": p99})
+        return res
+
+    async def batcher(self):
+        "group queued requests and send them to the workers"
+        loop = asyncio.get_running_loop()
+        # two batches per worker keep the workers busy while results are sent
+        slots = asyncio.Semaphore(2 * self.nb_proc)
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch += [self.queue.get_nowait()]
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch += [await asyncio.wait_for(self.queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    break
+            # spread the batch over the workers instead of running it in one
+            sub_size = -(-len(batch) // self.nb_proc)
+            for start in range(0, len(batch), sub_size):
+                await slots.acquire()
+                loop.create_task(self.run(batch[start:start+sub_size], slots))
+
+    async def run(self, batch, slots):
+        loop = asyncio.get_running_loop()
+        self.in_flight += len(batch)
+        self.nb_batch += 1
+        try:
+            results = await loop.run_in_executor(self.pool, run_batch,
+                                                 [(op, args) for op, args, _, _ in batch])
+        except Exception as e:
+            results = [(False, f"{type(e).__name__}: {e}")] * len(batch)
+        finally:
+            self.in_flight -= len(batch)
+            slots.release()
+        end = perf_counter()
+        for (_, _, fut, start), res in zip(batch, results):
+            self.latencies.append(end - start)
+            self.nb_done += 1
+            if not res[0]:
+                self.nb_error += 1
+            if not fut.done():
+                fut.set_result(res)
+
+    async def handle(self, reader, writer):
+        "one client connection, requests are answered as soon as they finish"
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(msg):
+            async with lock:
+                writer.write((json.dumps(msg) + "\n").encode())
+                await writer.drain()
+
+        async def answer(req_id, fut):
+            success, res = await fut
+            await respond({"id": req_id, "result": res} if success else
+                          {"id": req_id, "error": res})
+
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                req = json.loads(line)
+                req_id, op = req.get("id"), req["op"]
+            except (ValueError, KeyError, AttributeError) as e:
+                await respond({"id": None, "error": f"invalid request: {e}"})
+                continue
+            if op == "stats":
+                await respond({"id": req_id, "result": self.stats()})
+            elif op in OPERATIONS:
+                fut = loop.create_future()
+                await self.queue.put((op, req.get("args", {}), fut, perf_counter()))
+                task = loop.create_task(answer(req_id, fut))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                await respond({"id": req_id, "error": f"unknown operation {op}"})
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+    async def report(self, every):
+        while True:
+            await asyncio.sleep(every)
+            print(json.dumps(self.stats()), file=stderr, flush=True)
+
+    async def serve(self, socket=None, host="127.0.0.1", port=None, stats_every=None):
+        self.queue = asyncio.Queue()
+        self.start_pool()
+        if socket is not None:
+            if exists(socket):
+                remove(socket)
+            server = await asyncio.start_unix_server(self.handle, path=socket)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+        loop = asyncio.get_running_loop()
+        loop.create_task(self.batcher())
+        if stats_every:
+            loop.create_task(self.report(stats_every))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+class AsyncClient:
+    """asyncio client of the folding server, at most MAX_CONCURRENCY requests
+    are pending at the same time
+
+    async with AsyncClient(socket="/tmp/rafft.sock") as client:
+        res = await client.fold("GGGGAAAACCCC", max_stack=5)
+    """
+
+    def __init__(self, socket=None, host="127.0.0.1", port=None, max_concurrency=64):
+        self.socket, self.host, self.port = socket, host, port
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.ids = count()
+        self.pending = {}
+        self.reader, self.writer, self.listener = None, None, None
+
+    async def connect(self):
+        if self.socket is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.socket)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.listener = asyncio.get_running_loop().create_task(self.listen())
+        return self
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            fut = self.pending.pop(msg["id"], None)
+            if fut is not None and not fut.done():
+                if "error" in msg:
+                    fut.set_exception(RuntimeError(msg["error"]))
+                else:
+                    fut.set_result(msg["result"])
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, op, args=None):
+        async with self.limit:
+            req_id = next(self.ids)
+            fut = asyncio.get_running_loop().create_future()
+            self.pending[req_id] = fut
+            self.writer.write((json.dumps({"id": req_id, "op": op, "args": args or {}}) + "\n").encode())
+            await self.writer.drain()
+            return await fut
+
+    async def fold(self, sequence, **fold_args):
+        return await self.request("fold", dict(sequence=sequence, **fold_args))
+
+    async def kinetics(self, trajectory=None, sequence=None, **args):
+        if trajectory is not None:
+            args["trajectory"] = trajectory
+        else:
+            args["sequence"] = sequence
+        return await self.request("kinetics", args)
+
+    async def stats(self):
+        return await self.request("stats")
+
+    async def close(self):
+        self.writer.close()
+        self.listener.cancel()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def parse_arguments(argv=None):
+    """Parsing command line
+    """
+    parser = argparse.ArgumentParser(prog="rafft serve", description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--socket', '-S', help="Unix socket path")
+    parser.add_argument('--port', '-P', type=int, help="localhost TCP port", default=8642)
+    parser.add_argument('--host', help="TCP host", default="127.0.0.1")
+    parser.add_argument('--nb_proc', '-np', type=int, help="number of workers", default=1)
+    parser.add_argument('--batch_size', '-bs', type=int, help="maximum requests per batch", default=16)
+    parser.add_argument('--batch_wait', '-bw', type=float, help="maximum wait to fill a batch (ms)", default=5.0)
+    parser.add_argument('--stats_every', type=float, help="print statistics every N seconds on stderr")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    server = FoldServer(args.nb_proc, args.batch_size, args.batch_wait / 1000.0)
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port, args.stats_every))
+    except KeyboardInterrupt:
+        pass
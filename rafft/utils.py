@@ -1,9 +1,10 @@
 """Utils functions for the structure prediction
 """
 
-from numpy import array, flip, concatenate
-from numpy import sum as npsum
-from scipy.signal import convolve
+from numpy import array, concatenate, exp, frombuffer, cumsum, nonzero
+from numpy import argsort, uint8, int16, int32, int64
+from numpy import float64
+from rafft.correlation import correlate, encode_strands, overlap_norm
 from RNA import fold_compound, md
 
 class Glob_parms:
@@ -19,6 +20,20 @@ class Glob_parms:
         self.model.temperature = temp
         self.len_seq = len(sequence)
         self.seq_comp = fold_compound(sequence, self.model)
+        # candidate stems of each unpaired segment, keyed by positions
+        self.cor_cache = {}
+        # window slides of the segments by (positions, lag), see rafft.mutants
+        self.slide_cache = None
+        # periodic save of the search state
+        self.checkpoint, self.checkpoint_every = None, 1
+        # random generator of the sampling mode (deterministic search if None)
+        self.rng, self.sample_kt = None, 0.6
+        # precision of the correlations
+        self.cor_dtype = float64
+        # instrumentation (see rafft.profiling)
+        self.profiler = None
+        # folding paths (see rafft.path_graph)
+        self.graph = None
 
 
 class Node:
@@ -67,21 +82,88 @@ def paired_positions(structure):
     return pairs
 
 
-def prep_sequence(sequence, gc_wei=1.0, au_wei=1.0, gu_wei=1.0):
-    """Encode the sequence into two mirror strands
+def struct_matrix(structures):
+    "stack dot-bracket structures of the same length into a (nb_struct x len) uint8 matrix"
+    len_seq = len(structures[0]) if len(structures) > 0 else 0
+    smat = frombuffer("".join(structures).encode(), dtype=uint8)
+    return smat.reshape(len(structures), len_seq)
+
+
+def pair_arrays(smat):
+    """Base pairs of all the structures of a matrix at once, without loop over
+    structures (nested brackets only).
+
+    output:
+    struct_ids, pos_i, pos_j = arrays of the pairs (pos_i < pos_j) of each structure
     """
-    ENCODING = {"A": [1., 0, 0, 0], "G": [0, 1., 0, 0], "C": [0, 0, 1., 0], "U": [0, 0, 0, 1.], "N": [0, 0, 0, 0]}
-    CENCODING = {"A": [0, 0, 0, au_wei], "G": [0, 0, gc_wei, gu_wei], "C": [0, gc_wei, 0, 0], "U": [au_wei, gu_wei, 0, 0], "N": [0, 0, 0, 0]}
-    CAN_PAIR = [('A', 'U'), ('U', 'A'), ('G', 'C'), ('C', 'G'), ('G', 'U'), ('U', 'G')]
+    is_open = (smat == ord("(")) | (smat == ord("<"))
+    is_close = (smat == ord(")")) | (smat == ord(">"))
+    depth = cumsum(is_open.astype(int32) - is_close, axis=1,
+                   dtype=int16 if smat.shape[1] < 2**15 else int32)
+    s_o, p_o = nonzero(is_open)
+    s_c, p_c = nonzero(is_close)
+    # an opening at level l is closed by the next closing at level l
+    levels = concatenate((depth[s_o, p_o], depth[s_c, p_c] + 1)).astype(int64)
+    sids, pos = concatenate((s_o, s_c)), concatenate((p_o, p_c))
+    # sort by structure, level then position with a single key
+    len_seq = smat.shape[1]
+    order = argsort((sids * (len_seq + 1) + levels) * len_seq + pos, kind="stable")
+    sids, pos = sids[order], pos[order]
+    opened = order < len(s_o)
+    if len(order) % 2 or not (opened[0::2].all() and not opened[1::2].any()):
+        raise ValueError("unbalanced structure")
+    return sids[0::2], pos[0::2], pos[1::2]
+
+
+def pair_matrix(structures, len_seq=None):
+    """(nb_struct x len^2) sparse binary matrix of the base pairs of each
+    structure, column i*len + j for the pair (i, j). STRUCTURES are dot-brackets
+    or lists of pairs (then LEN_SEQ is needed)
+    """
+    from scipy.sparse import csr_matrix
+    from numpy import ones, fromiter, bincount
+    if len(structures) > 0 and isinstance(structures[0], str):
+        len_seq = len(structures[0])
+        sids, pos_i, pos_j = pair_arrays(struct_matrix(structures))
+    else:
+        sizes = fromiter((len(pairs) for pairs in structures), dtype=int64, count=len(structures))
+        sids = array(range(len(structures)), dtype=int64).repeat(sizes)
+        flat = array([pos for pairs in structures for pair in pairs for pos in pair], dtype=int64)
+        pos_i, pos_j = flat[0::2], flat[1::2]
+    len_seq = len_seq or 1
+    indptr = concatenate(([0], cumsum(bincount(sids, minlength=len(structures)))))
+    return csr_matrix((ones(len(sids), dtype=int32), pos_i * len_seq + pos_j, indptr),
+                      shape=(len(structures), len_seq**2))
+
+
+def subset_links(prev_mat, cur_mat, block_size=1024):
+    """All the pairs (p, c) such that the base pairs of the structure p are all
+    in the structure c, for two pair_matrix. The transpose of PREV_MAT is an
+    inverted index (base pair -> structures), so the product with CUR_MAT counts
+    the shared pairs of the structures sharing at least one; BLOCK_SIZE
+    structures of CUR_MAT at a time.
+
+    output:
+    prev_ids, cur_ids = arrays of the pairs
+    """
+    from numpy import diff, arange, tile
+    nb_pairs, nb_cur = diff(prev_mat.indptr), cur_mat.shape[0]
+    # the structures without pairs are in all the others
+    empty = nonzero(nb_pairs == 0)[0]
+    res_prev, res_cur = [empty.repeat(nb_cur)], [tile(arange(nb_cur), len(empty))]
+    index = prev_mat.T.tocsr()
+    for start in range(0, nb_cur, block_size):
+        shared = (cur_mat[start:start+block_size] @ index).tocoo()
+        keep = shared.data == nb_pairs[shared.col]
+        res_prev += [shared.col[keep].astype(int64)]
+        res_cur += [shared.row[keep].astype(int64) + start]
+    return concatenate(res_prev), concatenate(res_cur)
 
-    # the foward strand use the normal encoding
-    ENCODE = lambda s: array([ENCODING[n] for n in s])
-    # take the complementary nucleotides
-    C_ENCODE = lambda s: array([CENCODING[n] for n in s])
 
-    e_seq = ENCODE(sequence).T
-    c_seq = flip(C_ENCODE(sequence).T, axis=1)
-    return e_seq, c_seq
+def prep_sequence(sequence, gc_wei=1.0, au_wei=1.0, gu_wei=1.0):
+    """Encode the sequence into two mirror strands
+    """
+    return encode_strands(sequence, gc_wei, au_wei, gu_wei)
 
 
 def slice_string(seq):
@@ -112,30 +194,47 @@ def prep_sequence_stacks(sequence):
     return e_seq, c_seq
 
 
-def seq_conv(seq, cseq):
+def seq_conv(seq, cseq, dtype=float64, weights=None):
     "Compute the autocorrelation for the 4 components then sum per position"
-    cseq = flip(cseq, axis=1)
-    cor_ = []
-    for i in range(seq.shape[0]):
-        # the convolution routine will use the fft if faster
-        cor_ += [convolve(seq[i, ], cseq[i, ])]
-    return npsum(array(cor_), axis=0)
+    return correlate(seq, cseq, dtype, weights)
 
 
 def auto_cor(seq, cseq, pad=1.0):
     """Compute the auto correlation between the two strands
     """
-    len_seq = seq.shape[1]
     cor = seq_conv(seq, cseq)
-    norm = [(el+pad) for el in list(range(len_seq)) + list(range(len_seq-1))[::-1]]
-    cor_l = [[i, c] for i, c in enumerate(cor/norm)]
-    return cor_l
+    return [[i, c] for i, c in enumerate(cor / overlap_norm(seq.shape[1], pad))]
+
+
+def boltzmann_choice(rng, energies, kt, size=1):
+    """draw SIZE distinct indices with probabilities proportional to exp(-E/kT),
+    the indices whose weight underflows are taken last, by energy"""
+    energies = array(energies, dtype=float64)
+    size = min(size, len(energies))
+    weights = exp(-(energies - energies.min())/kt)
+    drawn = nonzero(weights)[0]
+    picks = rng.choice(drawn, size=min(size, len(drawn)), replace=False,
+                       p=weights[drawn]/weights[drawn].sum())
+    if len(picks) < size:
+        rest = nonzero(weights == 0.0)[0]
+        rest = rest[argsort(energies[rest], kind="stable")]
+        picks = concatenate((picks, rest[:size - len(picks)]))
+    return picks
 
 
 def eval_one_struct(pair_list, glob_parms):
     "eval individual loop moves"
+    prof = glob_parms.profiler
+    if prof is None:
+        dot_struct = dot_bracket(pair_list, glob_parms.len_seq)
+        return glob_parms.seq_comp.eval_structure(dot_struct)
+    prof.push("dot_bracket")
     dot_struct = dot_bracket(pair_list, glob_parms.len_seq)
-    return glob_parms.seq_comp.eval_structure(dot_struct)
+    prof.pop()
+    prof.push("vienna_eval")
+    nrj = glob_parms.seq_comp.eval_structure(dot_struct)
+    prof.pop()
+    return nrj
 
 
 def get_outer_loop(seq, cseq, max_i, max_j, max_bp, pos_list, len_seq):
@@ -170,16 +269,11 @@ def read_fasta(infile):
 
 
 def parse_rafft_output(infile):
-    results = []
-    with open(infile) as rafft_out:
-        seq = rafft_out.readline().strip()
-        for l in rafft_out:
-            if l.startswith("# --"):
-                results += [[]]
-            else:
-                str_struct, nrj = l.strip().split()
-                struct = Structure([], [])
-                struct.str_struct = str_struct
-                struct.energy = float(nrj)
-                results[-1] += [struct]
-    return results, seq
+    """read a RAFFT output (text or binary trajectory)
+
+    output:
+    fast_paths, seq = list of steps of Structure and the sequence
+    """
+    from rafft.rafft_io import read_trajectory
+    traj = read_trajectory(infile)
+    return traj.fast_paths(), traj.sequence
@@ -7,5 +7,5 @@ setup(
     authors="Vaitea Opuu, Nono S. C. Merleau, Matteo Smerlak",
     license="MIT",
     packages=["rafft"],
-    scripts=["bin/rafft", "bin/rafft_kin"],
+    scripts=["bin/rafft", "bin/rafft_kin", "bin/rafft_traj"],
     include_package_data=True)
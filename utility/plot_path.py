@@ -11,6 +11,7 @@ from os.path import realpath, dirname
 from PIL import Image, ImageDraw, ImageFont
 import aggdraw
 from colour import Color
+from rafft.rafft_io import read_trajectory
 
 
 def paired_positions(structure):
@@ -63,16 +64,9 @@ def add_grad_img(path_img, max_val, min_val, fnt):
 
 
 def parse_rafft_output(infile):
-    results = []
-    with open(infile) as rafft_out:
-        seq = rafft_out.readline().strip()
-        for l in rafft_out:
-            if l.startswith("# --"):
-                results += [[]]
-            else:
-                struct, nrj = l.strip().split()
-                results[-1] += [(struct, float(nrj))]
-    return results, seq
+    "steps of (structure, energy) of a RAFFT output (text or binary)"
+    traj = read_trajectory(infile)
+    return list(traj), traj.sequence
 
 
 def get_connected_prev(cur_struct, prev_pos):
@@ -14,6 +14,7 @@ from RNA import bp_distance
 from numpy import zeros, meshgrid, array, mgrid
 from numpy.random import RandomState
 from random import uniform
+from rafft.rafft_io import read_trajectory, unpack_structures
 
 
 def get_distance_matrix(structures):
@@ -27,17 +28,11 @@ def get_distance_matrix(structures):
 
 
 def parse_rafft_output(infile):
-    results = []
-    seen = set()
-    with open(infile) as rafft_out:
-        seq = rafft_out.readline().strip()
-        for l in rafft_out:
-            if not l.startswith("#"):
-                struct, nrj = l.strip().split()
-                if struct not in seen:
-                    results += [(struct, float(nrj))]
-                    seen.add(struct)
-    return results, seq
+    "unique structures of a RAFFT output (text or binary)"
+    traj = read_trajectory(infile)
+    ids = traj.unique()
+    structures = unpack_structures(traj.packed[ids], traj.len_seq)
+    return list(zip(structures, traj.energies[ids].tolist())), traj.sequence
 
 
 def parse_barrier_output(infile):